@@ -0,0 +1,180 @@
+"""Cross-process notification bus for location changes.
+
+Each worker process keeps its own location cache and stream subscribers, so
+workers tell each other about new positions and cache invalidations. Two
+transports are provided:
+
+- MongoChangeStreamBus follows a MongoDB change stream on the locations
+  collection and a capped bus_events collection that carries every other
+  message; every worker sees both, on any host. Needs a replica set or
+  sharded cluster.
+- UnixSocketBus sends datagrams between the workers on one host through
+  Unix sockets in a shared directory.
+
+Messages are dicts: {'type': 'location', 'location': {...}},
+{'type': 'invalidate', 'target_id': <id or None>}, and geofence changes
+{'type': 'geofence', 'registration': {...}, 'target': [latitude, longitude]}
+or {'type': 'geofence_removed', 'device_id': <id>}.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from pathlib import Path
+from typing import Callable, Optional, Set
+
+import orjson
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[dict], None]
+
+# Datagrams carry a single small JSON message
+MAX_DATAGRAM = 64 * 1024
+
+
+class UnixSocketBus:
+    """Datagram fan-out between worker processes on a single host"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.path = self.directory / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+        self._sock: Optional[socket.socket] = None
+        self._handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._handler = handler
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind(str(self.path))
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._receive)
+        logger.info(f"Location bus listening on {self.path}")
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                self._handler(orjson.loads(data))
+            except Exception as e:
+                logger.error(f"Error handling location bus message: {e}")
+
+    def publish(self, message: dict) -> None:
+        if self._sock is None:
+            return
+        data = orjson.dumps(message)
+        for peer in self.directory.glob('*.sock'):
+            if peer == self.path:
+                continue
+            try:
+                self._sock.sendto(data, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited
+                peer.unlink(missing_ok=True)
+            except BlockingIOError:
+                logger.warning(f"Location bus peer {peer.name} is not keeping up, message dropped")
+            except OSError as e:
+                logger.warning(f"Error sending to location bus peer {peer.name}: {e}")
+
+    async def close(self) -> None:
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            self.path.unlink(missing_ok=True)
+
+
+class MongoChangeStreamBus:
+    """Fan-out between workers through one MongoDB change stream.
+
+    Every write to the locations collection reaches every worker through the
+    stream. Other messages (invalidations, locations held back from storage,
+    geofence changes) are inserted into a small capped collection followed by
+    the same stream; a worker skips the ones it inserted itself.
+    """
+
+    EVENTS = 'bus_events'
+    # Change streams only need recent events, so the collection is kept small
+    EVENTS_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, database, retry_delay: float = 1.0):
+        self.database = database
+        self.retry_delay = retry_delay
+        self.sender = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self._inserts: Set[asyncio.Task] = set()
+
+    @staticmethod
+    async def supported(database) -> bool:
+        """Change streams need a replica set member or a mongos"""
+        hello = await database.command('hello')
+        return 'setName' in hello or hello.get('msg') == 'isdbgrid'
+
+    async def start(self, handler: MessageHandler) -> None:
+        try:
+            await self.database.create_collection(self.EVENTS, capped=True, size=self.EVENTS_SIZE)
+        except CollectionInvalid:
+            # Created by another worker
+            pass
+        self._task = asyncio.create_task(self._watch(handler))
+
+    async def _watch(self, handler: MessageHandler) -> None:
+        pipeline = [{'$match': {'$or': [
+            {'ns.coll': 'locations', 'operationType': {'$in': ['insert', 'replace', 'update']}},
+            {'ns.coll': self.EVENTS, 'operationType': 'insert', 'fullDocument.sender': {'$ne': self.sender}},
+        ]}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.database.watch(pipeline, full_document='updateLookup',
+                                               resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get('fullDocument')
+                        if document is None:
+                            continue
+                        if change['ns']['coll'] == self.EVENTS:
+                            message = document['message']
+                        else:
+                            document.pop('_id', None)
+                            document.pop('location', None)
+                            message = {'type': 'location', 'location': document}
+                        try:
+                            handler(message)
+                        except Exception as e:
+                            logger.error(f"Error handling location bus message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Location change stream interrupted, retrying: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    def publish(self, message: dict) -> None:
+        if self._task is None:
+            return
+        insert = asyncio.create_task(self._insert(message))
+        self._inserts.add(insert)
+        insert.add_done_callback(self._inserts.discard)
+
+    async def _insert(self, message: dict) -> None:
+        try:
+            await self.database[self.EVENTS].insert_one({'sender': self.sender, 'message': message})
+        except Exception as e:
+            logger.warning(f"Error publishing to the location bus: {e}")
+
+    async def close(self) -> None:
+        if self._inserts:
+            await asyncio.gather(*self._inserts, return_exceptions=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
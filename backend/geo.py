@@ -0,0 +1,196 @@
+"""Vectorized geodesy helpers for location endpoints."""
+
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Same mean radius as LocationService in the app
+EARTH_RADIUS_KM = 6371.0
+EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Haversine distance in metres between two points (scalar version)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def bounding_boxes(latitude: float, longitude: float, radius_km: float) -> List[Tuple[float, float, float, float]]:
+    """(min_lat, max_lat, min_lon, max_lon) boxes covering a circle on the sphere.
+
+    The box is split in two where it crosses the antimeridian and spans all
+    longitudes when the circle reaches a pole.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    if angle >= math.pi:
+        return [(-90.0, 90.0, -180.0, 180.0)]
+    delta_lat = math.degrees(angle)
+    min_lat, max_lat = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    delta_lon = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(latitude)), 1.0)))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if max_lon - min_lon >= 360:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def bearings_and_distances(latitudes, longitudes, target_latitude: float, target_longitude: float):
+    """Initial bearing and haversine distance from each observer to a target.
+
+    Uses the same formulas as LocationService.calculateBearing and
+    calculateDistance. Returns (bearings in degrees 0-360, distances in km).
+    """
+    phi1 = np.radians(np.asarray(latitudes, dtype=float))
+    lon1 = np.asarray(longitudes, dtype=float)
+    phi2 = np.radians(target_latitude)
+    delta_lambda = np.radians(target_longitude - lon1)
+
+    y = np.sin(delta_lambda) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(delta_lambda)
+    bearings = np.degrees(np.arctan2(y, x)) % 360
+
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    a = np.clip(a, 0, 1)
+    distances = 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return bearings, distances
+
+
+def turn_angles(headings, bearings) -> np.ndarray:
+    """Signed turn from each heading to its bearing in degrees (-180, 180].
+
+    Positive means turn right, matching LocationService.getTurnDirection.
+    """
+    diff = (np.asarray(bearings, dtype=float) - np.asarray(headings, dtype=float) + 180) % 360 - 180
+    diff[diff == -180] = 180
+    return diff
+
+
+def simplify_path(latitudes, longitudes, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker simplification of a track.
+
+    Points are projected onto a local equirectangular plane, which is accurate
+    for the short tracks we simplify. Returns the indices of the points to
+    keep; the first and last points are always kept.
+    """
+    lat = np.asarray(latitudes, dtype=float)
+    lon = np.asarray(longitudes, dtype=float)
+    n = len(lat)
+    if n < 3:
+        return np.arange(n)
+
+    y = np.radians(lat) * EARTH_RADIUS_M
+    x = np.radians(lon) * np.cos(np.radians(lat.mean())) * EARTH_RADIUS_M
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / length_sq, 0, 1)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def smooth_fixes(times, latitudes, longitudes, accuracies, speed: float, outlier_sigma: float,
+                 prior: Optional[Tuple[float, float, float, float]] = None):
+    """Reject outlying GPS fixes and smooth the rest.
+
+    The target may have moved up to about `speed` m/s between fixes, so a fix
+    with accuracy a (metres, one standard deviation) taken dt seconds away
+    measures its position with variance a² + (speed * dt)². Each estimate is the inverse-variance weighted
+    mean of the fixes; the weights for every pair of fixes form one matrix,
+    so the whole batch is filtered without a per-fix loop.
+
+    With three or more fixes, outliers are removed one at a time: the fix
+    furthest (in standard deviations) from the estimate the other accepted
+    fixes make at its time is rejected while that exceeds `outlier_sigma`
+    (0 disables this). Removing the worst fix first keeps a single large
+    jump from dragging the good fixes' estimates past the threshold; at most
+    a minority of the batch is ever rejected.
+    `prior` is an earlier estimate as (time, latitude, longitude, variance);
+    it is ignored if the batch disagrees with it by the same test.
+
+    Times are in seconds. Returns (kept, latitudes, longitudes, variances):
+    the indices of the accepted fixes in time order, and at each of them the
+    smoothed position from it and the accepted fixes before it, with that
+    position's variance in m².
+    """
+    t = np.asarray(times, dtype=float)
+    order = np.argsort(t, kind='stable')
+    t = t[order]
+    lat = np.asarray(latitudes, dtype=float)[order]
+    lon = np.asarray(longitudes, dtype=float)[order]
+    variance = np.asarray(accuracies, dtype=float)[order] ** 2
+
+    # Local equirectangular plane around the first fix, in metres
+    ref_lat, ref_lon = lat[0], lon[0]
+    y_scale = math.radians(1) * EARTH_RADIUS_M
+    x_scale = y_scale * max(math.cos(math.radians(ref_lat)), 1e-6)
+    x = ((lon - ref_lon + 180) % 360 - 180) * x_scale
+    y = (lat - ref_lat) * y_scale
+
+    # weights[i, j]: inverse variance of fix j as a measurement at fix i's time
+    weights = 1 / (variance[None, :] + (speed * (t[:, None] - t[None, :])) ** 2)
+
+    accepted = np.ones(len(t), dtype=bool)
+    if len(t) >= 3 and outlier_sigma > 0:
+        others = weights.copy()
+        np.fill_diagonal(others, 0)
+        # Leave-one-out sums, updated as fixes are rejected
+        total = others.sum(axis=1)
+        sum_x = others @ x
+        sum_y = others @ y
+        for _ in range((len(t) - 1) // 2):
+            residual_sq = (x - sum_x / total) ** 2 + (y - sum_y / total) ** 2
+            score = np.where(accepted, residual_sq / (variance + 1 / total), -np.inf)
+            worst = int(score.argmax())
+            if score[worst] <= outlier_sigma ** 2:
+                break
+            accepted[worst] = False
+            total -= others[:, worst]
+            sum_x -= others[:, worst] * x[worst]
+            sum_y -= others[:, worst] * y[worst]
+
+    # Each accepted fix is estimated from itself and the accepted fixes before it
+    w = np.tril(weights)[accepted][:, accepted]
+    total = w.sum(axis=1)
+    sum_x = w @ x[accepted]
+    sum_y = w @ y[accepted]
+
+    if prior is not None:
+        prior_time, prior_lat, prior_lon, prior_variance = prior
+        prior_x = ((prior_lon - ref_lon + 180) % 360 - 180) * x_scale
+        prior_y = (prior_lat - ref_lat) * y_scale
+        prior_weights = 1 / (prior_variance + (speed * np.maximum(t[accepted] - prior_time, 0)) ** 2)
+        # Compare with the estimate from the whole batch, at its last fix
+        residual_sq = (sum_x[-1] / total[-1] - prior_x) ** 2 + (sum_y[-1] / total[-1] - prior_y) ** 2
+        if outlier_sigma <= 0 or residual_sq <= outlier_sigma ** 2 * (1 / total[-1] + 1 / prior_weights[-1]):
+            total = total + prior_weights
+            sum_x = sum_x + prior_weights * prior_x
+            sum_y = sum_y + prior_weights * prior_y
+
+    smoothed_lat = ref_lat + sum_y / total / y_scale
+    smoothed_lon = (ref_lon + sum_x / total / x_scale + 180) % 360 - 180
+    return order[accepted], smoothed_lat, smoothed_lon, 1 / total
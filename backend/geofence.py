@@ -0,0 +1,209 @@
+"""Geofences around location targets, evaluated incrementally.
+
+Devices register a position and a radius around a target. They are kept in
+a latitude/longitude grid per target, so when the target moves only devices
+in the cells around its old and new positions are re-checked: a device can
+only enter or leave its fence if it is within its radius of one of them.
+Devices are grouped by radius (powers of two) so that a few large fences do
+not widen the search for all the small ones.
+"""
+
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M, bearings_and_distances
+
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+# Expired registrations are swept from register(), update_target() and len()
+# at most this often; update_target() also skips any it meets before then
+SWEEP_INTERVAL = 60.0
+
+Cell = Tuple[int, int]
+Box = Tuple[int, int, int, int]  # first/last latitude cell, first/last longitude cell
+
+
+class GeofenceTransition(NamedTuple):
+    device_id: str
+    target_id: str
+    entered: bool
+    distance: float  # metres from the target
+    radius: float
+
+
+class Device:
+    __slots__ = ('device_id', 'target_id', 'latitude', 'longitude', 'radius', 'inside', 'distance',
+                 'tier', 'cell', 'expires_at')
+
+    def __init__(self, device_id: str, target_id: str, latitude: float, longitude: float,
+                 radius: float, tier: int, cell: Cell, expires_at: float):
+        self.device_id = device_id
+        self.target_id = target_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.inside: Optional[bool] = None
+        self.distance: Optional[float] = None
+        self.tier = tier
+        self.cell = cell
+        self.expires_at = expires_at
+
+
+class GeofenceRegistry:
+    def __init__(self, cell_size: float, ttl: float):
+        self.cell_size = cell_size  # degrees
+        self.ttl = ttl
+        self._lon_cells = math.ceil(360 / cell_size)
+        self._devices: Dict[str, Device] = {}
+        # target id -> radius tier -> cell -> device ids
+        self._grids: Dict[str, Dict[int, Dict[Cell, Set[str]]]] = {}
+        self._targets: Dict[str, Tuple[float, float]] = {}
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def __len__(self) -> int:
+        self._sweep_if_due(time.monotonic())
+        return len(self._devices)
+
+    def _sweep_if_due(self, now: float) -> None:
+        if now >= self._next_sweep:
+            self.sweep()
+            self._next_sweep = now + SWEEP_INTERVAL
+
+    def get(self, device_id: str) -> Optional[Device]:
+        device = self._devices.get(device_id)
+        if device is not None and device.expires_at <= time.monotonic():
+            self.unregister(device_id)
+            return None
+        return device
+
+    def target_position(self, target_id: str) -> Optional[Tuple[float, float]]:
+        return self._targets.get(target_id)
+
+    def _cell(self, latitude: float, longitude: float) -> Cell:
+        return (math.floor(latitude / self.cell_size),
+                math.floor(longitude / self.cell_size) % self._lon_cells)
+
+    def _box(self, latitude: float, longitude: float, radius: float) -> Box:
+        """Grid cell ranges covering the bounding box of a circle"""
+        lat_span = radius / METRES_PER_DEGREE
+        lon_span = lat_span / max(math.cos(math.radians(min(abs(latitude) + lat_span, 90.0))), 1e-6)
+        first_lon = math.floor((longitude - lon_span) / self.cell_size)
+        last_lon = min(math.floor((longitude + lon_span) / self.cell_size), first_lon + self._lon_cells - 1)
+        return (math.floor((latitude - lat_span) / self.cell_size),
+                math.floor((latitude + lat_span) / self.cell_size),
+                first_lon, last_lon)
+
+    def _in_box(self, cell: Cell, box: Box) -> bool:
+        first_lat, last_lat, first_lon, last_lon = box
+        return first_lat <= cell[0] <= last_lat and (cell[1] - first_lon) % self._lon_cells <= last_lon - first_lon
+
+    def _cells_near(self, grid: Dict[Cell, Set[str]], boxes: List[Box]) -> Set[Cell]:
+        """Occupied cells inside any of the boxes.
+
+        Walks the boxes cell by cell when they are small, and filters the
+        occupied cells instead when that is cheaper (large radii, sparse grids).
+        """
+        size = sum((box[1] - box[0] + 1) * (box[3] - box[2] + 1) for box in boxes)
+        if size > len(grid):
+            return {cell for cell in grid if any(self._in_box(cell, box) for box in boxes)}
+        return {(i, j % self._lon_cells)
+                for first_lat, last_lat, first_lon, last_lon in boxes
+                for i in range(first_lat, last_lat + 1)
+                for j in range(first_lon, last_lon + 1)
+                if (i, j % self._lon_cells) in grid}
+
+    def register(self, device_id: str, target_id: str, latitude: float, longitude: float,
+                 radius: float) -> Optional[GeofenceTransition]:
+        """Add or move a device; returns a transition if its state changed"""
+        now = time.monotonic()
+        self._sweep_if_due(now)
+
+        previous = self._devices.get(device_id)
+        was_inside = previous.inside if previous is not None and previous.target_id == target_id else None
+        if previous is not None:
+            self.unregister(device_id)
+
+        tier = max(0, math.ceil(math.log2(radius)))
+        device = Device(device_id, target_id, latitude, longitude, radius, tier,
+                        self._cell(latitude, longitude), now + self.ttl)
+        self._devices[device_id] = device
+        self._grids.setdefault(target_id, {}).setdefault(tier, {}).setdefault(device.cell, set()).add(device_id)
+
+        device.inside = was_inside
+        target = self._targets.get(target_id)
+        if target is None:
+            return None
+        return self._evaluate([device], *target)[0]
+
+    def unregister(self, device_id: str) -> bool:
+        device = self._devices.pop(device_id, None)
+        if device is None:
+            return False
+        tiers = self._grids[device.target_id]
+        grid = tiers[device.tier]
+        members = grid[device.cell]
+        members.discard(device_id)
+        if not members:
+            del grid[device.cell]
+            if not grid:
+                del tiers[device.tier]
+                if not tiers:
+                    del self._grids[device.target_id]
+        return True
+
+    def sweep(self) -> int:
+        """Remove devices whose registration expired; returns how many"""
+        now = time.monotonic()
+        expired = [device_id for device_id, device in self._devices.items() if device.expires_at <= now]
+        for device_id in expired:
+            self.unregister(device_id)
+        return len(expired)
+
+    def update_target(self, target_id: str, latitude: float, longitude: float) -> List[GeofenceTransition]:
+        """Record a target's new position and return the fence transitions it caused"""
+        now = time.monotonic()
+        self._sweep_if_due(now)
+        previous = self._targets.get(target_id)
+        self._targets[target_id] = (latitude, longitude)
+        tiers = self._grids.get(target_id)
+        if not tiers:
+            return []
+
+        candidates = []
+        for tier, grid in tiers.items():
+            if previous is None:
+                cells = grid.keys()
+            else:
+                radius = 2.0 ** tier
+                cells = self._cells_near(grid, [self._box(latitude, longitude, radius),
+                                                self._box(previous[0], previous[1], radius)])
+            candidates.extend(self._devices[device_id] for cell in cells for device_id in grid[cell])
+        for device in [device for device in candidates if device.expires_at <= now]:
+            # Expired since the last sweep; must not alert
+            self.unregister(device.device_id)
+            candidates.remove(device)
+        return [transition for transition in self._evaluate(candidates, latitude, longitude)
+                if transition is not None]
+
+    def _evaluate(self, devices: List[Device], latitude: float,
+                  longitude: float) -> List[Optional[GeofenceTransition]]:
+        """Recompute fence state for devices against a target position"""
+        if not devices:
+            return []
+        _, distances_km = bearings_and_distances(
+            np.fromiter((device.latitude for device in devices), float, len(devices)),
+            np.fromiter((device.longitude for device in devices), float, len(devices)),
+            latitude, longitude)
+        transitions: List[Optional[GeofenceTransition]] = []
+        for device, distance_km in zip(devices, distances_km.tolist()):
+            distance = distance_km * 1000
+            inside = distance <= device.radius
+            changed = device.inside is not None and inside != device.inside
+            device.inside = inside
+            device.distance = distance
+            transitions.append(GeofenceTransition(device.device_id, device.target_id, inside, distance,
+                                                  device.radius) if changed else None)
+        return transitions
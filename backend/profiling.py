@@ -0,0 +1,214 @@
+"""Sampling profilers for production debugging.
+
+Profiles are written in the folded-stack format ("outer;inner;leaf count"
+per line) read by flamegraph.pl, inferno and speedscope.
+
+- ProfilingMiddleware profiles single requests that carry a secret token.
+  Samples are taken from the event loop thread and kept only while that
+  request is running, so concurrent requests do not blur the profile. While
+  the request is suspended its await chain is recorded instead, ending in
+  "[awaiting]", which shows time spent waiting on MongoDB or Supabase.
+- BackgroundSampler samples every thread at a low rate and writes the
+  counts to a new file at a fixed interval.
+
+Both run in a separate thread and cost nothing unless enabled.
+"""
+
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def frame_label(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def await_chain(awaitable) -> List[str]:
+    """Labels of a suspended coroutine and everything it is awaiting, outermost first"""
+    labels = []
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'ag_frame', None) \
+            or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            break
+        labels.append(frame_label(frame.f_code))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'ag_await', None) \
+            or getattr(awaitable, 'gi_yieldfrom', None)
+    return labels
+
+
+def write_folded(path: Path, samples: Dict[str, int]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(f"{stack} {count}\n" for stack, count in sorted(samples.items())))
+
+
+def profile_path(directory: str, kind: str, detail: str = '') -> Path:
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+    detail = re.sub(r'[^A-Za-z0-9]+', '_', detail).strip('_')
+    name = '-'.join(part for part in (kind, stamp, detail, uuid.uuid4().hex[:8]) if part)
+    return Path(directory) / f"{name}.folded"
+
+
+class RequestProfiler:
+    """Samples one coroutine running on the current thread until stopped"""
+
+    def __init__(self, coroutine, interval: float):
+        self.coroutine = coroutine
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        marker = self.coroutine.cr_frame
+        if marker is None:
+            return
+        frames = []
+        frame = sys._current_frames().get(self._thread_id)
+        while frame is not None and frame is not marker:
+            frames.append(frame)
+            frame = frame.f_back
+        if frame is marker:
+            frames.append(marker)
+            labels = [frame_label(frame.f_code) for frame in reversed(frames)]
+        else:
+            labels = await_chain(self.coroutine) + ['[awaiting]']
+        self.samples[';'.join(labels)] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that present the profiling token.
+
+    The token goes in an X-Profile header or a `profile` query parameter.
+    The profile is written to `directory` and its file name returned in the
+    X-Profile response header.
+    """
+
+    def __init__(self, app, token: str, directory: str, interval: float):
+        self.app = app
+        self.token = token.encode()
+        self.directory = directory
+        self.interval = interval
+        self._active = 0
+        self._switch_interval = sys.getswitchinterval()
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope['headers']:
+            if name == b'x-profile':
+                return hmac.compare_digest(value, self.token)
+        query = scope.get('query_string', b'')
+        if b'profile=' in query:
+            for pair in query.split(b'&'):
+                if pair.startswith(b'profile='):
+                    return hmac.compare_digest(pair[len(b'profile='):], self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        path = profile_path(self.directory, 'request', f"{scope['method']} {scope['path']}")
+
+        async def send_with_profile(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), (b'x-profile', path.name.encode())]
+            await send(message)
+
+        # The sampler needs the GIL to take a sample, so have the event loop
+        # thread release it at least as often while any profile is running
+        if self._active == 0:
+            self._switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self.interval, self._switch_interval))
+        self._active += 1
+        coroutine = self.app(scope, receive, send_with_profile)
+        profiler = RequestProfiler(coroutine, self.interval)
+        profiler.start()
+        try:
+            await coroutine
+        finally:
+            samples = profiler.stop()
+            self._active -= 1
+            if self._active == 0:
+                sys.setswitchinterval(self._switch_interval)
+            try:
+                write_folded(path, samples)
+            except OSError as e:
+                logger.error(f"Error writing request profile {path}: {e}")
+
+
+class BackgroundSampler:
+    """Samples all threads every `interval` seconds, writing a profile every `dump_interval`"""
+
+    def __init__(self, directory: str, interval: float, dump_interval: float):
+        self.directory = directory
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self._samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='background-sampler', daemon=True)
+        self._thread.start()
+        logger.info(f"Background profiler sampling every {self.interval}s into {self.directory}")
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._dump()
+
+    def _run(self) -> None:
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_dump:
+                self._dump()
+                next_dump = time.monotonic() + self.dump_interval
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            self._samples[';'.join(reversed(labels))] += 1
+
+    def _dump(self) -> None:
+        samples, self._samples = self._samples, Counter()
+        if not samples:
+            return
+        try:
+            write_folded(profile_path(self.directory, f"sampler-{os.getpid()}"), samples)
+        except OSError as e:
+            logger.error(f"Error writing background profile: {e}")
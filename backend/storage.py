@@ -0,0 +1,1087 @@
+"""Storage backends for locations, location history and status checks.
+
+Storage is the interface the API uses; records are plain dicts shaped like
+the API models, with naive UTC datetimes. Implementations:
+
+- MongoStorage: MongoDB through Motor. Nearby queries use a 2dsphere index
+  and status checks are rolled up by a background stage.
+- SupabaseStorage: current locations in Supabase, everything else in a
+  MongoStorage that also keeps a copy of each location (for nearby queries)
+  and serves locations while Supabase's circuit breaker is open.
+- SQLiteStorage: a single SQLite file, for single-node deployments. Nearby
+  queries use an R*Tree index.
+- MemoryStorage: process-local and lost on restart, for benchmarks and
+  local runs without external services. Nearby queries scan every target.
+
+The SQLite and memory backends aggregate status rollups from the raw checks
+on each request, so those reads grow with the retained checks.
+"""
+
+import asyncio
+import logging
+import math
+import sqlite3
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from supabase import Client, ClientOptions, create_client
+
+from geo import EARTH_RADIUS_KM, bearings_and_distances, bounding_boxes
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Keyset position in the status check order: (timestamp, id)
+StatusKey = Tuple[datetime, str]
+Track = Callable[[str, str], ContextManager[None]]
+
+
+@contextmanager
+def no_track(backend: str, operation: str) -> Iterator[None]:
+    yield
+
+
+def bucket_start(timestamp: datetime, width: int) -> datetime:
+    """Start of the `width`-second bucket holding timestamp"""
+    offset = (timestamp - EPOCH) // timedelta(milliseconds=1)
+    return EPOCH + timedelta(milliseconds=offset - offset % (width * 1000))
+
+
+def nearest(locations: Iterable[dict], latitude: float, longitude: float,
+            radius: Optional[float], limit: int) -> List[dict]:
+    """Locations closest to a point with their distance in km, for backends without a geo index"""
+    locations = list(locations)
+    if not locations:
+        return []
+    _, distances = bearings_and_distances(
+        [location['latitude'] for location in locations],
+        [location['longitude'] for location in locations],
+        latitude, longitude)
+    order = np.argsort(distances, kind='stable')
+    if radius is not None:
+        order = order[distances[order] <= radius]
+    return [{**locations[i], 'distance': float(distances[i])} for i in order[:limit]]
+
+
+class Storage:
+    """Interface shared by the storage backends"""
+
+    name = 'storage'
+    # True while a backend is serving locations in place of the configured one
+    fallback_active = False
+
+    async def start(self) -> None:
+        """Connect, create indexes and start any background work"""
+
+    async def close(self) -> None:
+        """Stop background work and release connections"""
+
+    async def get_location(self, target_id: str) -> Optional[dict]:
+        """A target's current location, None if not stored"""
+        raise NotImplementedError
+
+    async def put_location(self, location: dict, operation: str) -> dict:
+        """Create or replace a target's location; returns the stored record"""
+        raise NotImplementedError
+
+    async def nearby_locations(self, latitude: float, longitude: float, radius: Optional[float],
+                               limit: int) -> List[dict]:
+        """Locations nearest a point, closest first, with `distance` in km, within `radius` km if given"""
+        raise NotImplementedError
+
+    async def add_history(self, points: List[dict]) -> None:
+        """Append points (target_id, latitude, longitude, address, updated_at) to the history"""
+        raise NotImplementedError
+
+    async def location_history(self, target_id: str, since: datetime, until: Optional[datetime],
+                               bucket: Optional[int], limit: int) -> List[dict]:
+        """A target's points oldest first, or with `bucket` (seconds) one averaged point per bucket with its count"""
+        raise NotImplementedError
+
+    async def insert_status_checks(self, status_checks: List[dict], operation: str) -> None:
+        raise NotImplementedError
+
+    async def list_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                 until: Optional[datetime], after: Optional[StatusKey],
+                                 limit: int) -> List[dict]:
+        """Status checks ordered by (timestamp, id), starting after the `after` key"""
+        raise NotImplementedError
+
+    async def stream_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                   until: Optional[datetime], after: Optional[StatusKey],
+                                   limit: Optional[int], batch_size: int) -> AsyncIterator[dict]:
+        """Every matching status check, up to `limit`, read `batch_size` at a time"""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            page = await self.list_status_checks(client_name, since, until, after, size)
+            for status_check in page:
+                yield status_check
+            if len(page) < size:
+                return
+            after = (page[-1]['timestamp'], page[-1]['id'])
+            if remaining is not None:
+                remaining -= len(page)
+
+    async def status_rollups(self, interval: int, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], limit: int) -> List[dict]:
+        """Status check counts per client per `interval`-second bucket, ordered by (bucket, client_name)"""
+        raise NotImplementedError
+
+
+class CircuitBreaker:
+    """Routes calls away from a backend whose recent calls fail or are slow.
+
+    While closed the backend is used. The breaker opens when the error rate
+    or mean latency over the last `window` calls crosses its threshold, and
+    closes again on the next fast, successful call (normally a health probe).
+    It starts open so nothing is routed to the backend before it is probed.
+    """
+
+    def __init__(self, name: str, window: int, error_threshold: float,
+                 latency_threshold: float, min_calls: int = 5):
+        self.name = name
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.min_calls = min(min_calls, window)
+        self.closed = False
+        self.on_change: Optional[Callable[[bool], None]] = None
+        self._calls: deque = deque(maxlen=window)
+
+    def record(self, ok: bool, latency: float) -> None:
+        if not self.closed:
+            if ok and latency < self.latency_threshold:
+                self._set_closed(True, f"healthy call in {latency * 1000:.0f}ms")
+            return
+
+        self._calls.append((ok, latency))
+        if len(self._calls) < self.min_calls:
+            return
+        error_rate = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+        mean_latency = sum(latency for _, latency in self._calls) / len(self._calls)
+        if error_rate >= self.error_threshold:
+            self._set_closed(False, f"error rate {error_rate:.0%}")
+        elif mean_latency >= self.latency_threshold:
+            self._set_closed(False, f"mean latency {mean_latency * 1000:.0f}ms")
+
+    def _set_closed(self, closed: bool, reason: str) -> None:
+        self.closed = closed
+        self._calls.clear()
+        if closed:
+            logger.info(f"{self.name} circuit closed ({reason})")
+        else:
+            logger.warning(f"{self.name} circuit opened ({reason}), using MongoDB fallback")
+        if self.on_change is not None:
+            self.on_change(closed)
+
+
+async def ensure_ttl_index(collection, field: str, seconds: float) -> None:
+    """Create, retune or drop the TTL index on `field` (seconds <= 0 drops it)"""
+    name = f'{field}_ttl'
+    if seconds <= 0:
+        if name in await collection.index_information():
+            await collection.drop_index(name)
+        return
+    try:
+        await collection.create_index([(field, 1)], name=name, expireAfterSeconds=int(seconds))
+    except OperationFailure:
+        # Exists with another expiry
+        await collection.database.command('collMod', collection.name,
+                                          index={'name': name, 'expireAfterSeconds': int(seconds)})
+
+
+def geo_point(latitude: float, longitude: float) -> dict:
+    """GeoJSON point for the 2dsphere index (longitude first)"""
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+
+class StatusRollupAggregator:
+    """Background stage folding raw status checks into per-client rollups.
+
+    Each pass takes the checks stored since a watermark (up to `lag` seconds
+    ago, at most `max_span` seconds at a time) and recomputes, per bucket
+    width, the per-client counts of every bucket that range touches from the
+    raw checks, replacing the stored rollups. The shared watermark advances
+    with a compare-and-set only once every width is written, so a pass that
+    fails or whose worker dies is simply repeated, and passes repeated by
+    several workers write the same counts.
+    """
+
+    STATE_ID = 'status_checks'
+
+    def __init__(self, db, buckets: List[int], period: float, lag: float, max_span: float,
+                 retention: float, track: Track = no_track):
+        self.db = db
+        self.buckets = buckets
+        self.period = period
+        self.lag = timedelta(seconds=lag)
+        self.max_span = timedelta(seconds=max_span)
+        self.retention = timedelta(seconds=retention)
+        self.track = track
+
+    async def _watermark(self) -> Optional[datetime]:
+        state = await self.db.status_rollup_state.find_one({'_id': self.STATE_ID})
+        if state is not None:
+            return state['watermark']
+        oldest = await self.db.status_checks.find_one({}, {'_id': 0, 'timestamp': 1}, sort=[('timestamp', 1), ('id', 1)])
+        if oldest is None:
+            return None
+        try:
+            await self.db.status_rollup_state.insert_one({'_id': self.STATE_ID, 'watermark': oldest['timestamp']})
+        except DuplicateKeyError:
+            # Another worker started first
+            return (await self.db.status_rollup_state.find_one({'_id': self.STATE_ID}))['watermark']
+        return oldest['timestamp']
+
+    async def run_once(self) -> bool:
+        """Summarize the next range of checks; True if a backlog remains after it"""
+        start = await self._watermark()
+        if start is None:
+            return False
+        end = min(datetime.utcnow() - self.lag, start + self.max_span)
+        if end <= start:
+            return False
+        with self.track('mongodb', 'status_rollup'):
+            for interval in self.buckets:
+                await self._summarize(start, end, interval)
+        advanced = await self.db.status_rollup_state.update_one(
+            {'_id': self.STATE_ID, 'watermark': start}, {'$set': {'watermark': end}})
+        # Otherwise another worker summarized this range first
+        return advanced.modified_count > 0 and end - start >= self.max_span
+
+    async def _summarize(self, start: datetime, end: datetime, interval: int) -> None:
+        """Recount the `interval` buckets overlapping [start, end) from the raw checks"""
+        width = interval * 1_000_000
+        first = bucket_start(start, interval)
+        last = from_micros(ceil_bucket(to_micros(end), width))
+        epoch_ms = {'$subtract': ['$timestamp', EPOCH]}
+        pipeline = [
+            {'$match': {'timestamp': {'$gte': first, '$lt': last}}},
+            {'$group': {
+                '_id': {
+                    'client_name': '$client_name',
+                    'bucket': {'$subtract': [epoch_ms, {'$mod': [epoch_ms, interval * 1000]}]},
+                },
+                'count': {'$sum': 1},
+                'first_seen': {'$min': '$timestamp'},
+                'last_seen': {'$max': '$timestamp'},
+            }},
+        ]
+        updates = [
+            UpdateOne(
+                {'interval': interval, 'client_name': group['_id']['client_name'],
+                 'bucket': EPOCH + timedelta(milliseconds=group['_id']['bucket'])},
+                {'$set': {'count': group['count'], 'first_seen': group['first_seen'],
+                          'last_seen': group['last_seen']}},
+                upsert=True,
+            )
+            async for group in self.db.status_checks.aggregate(pipeline)
+        ]
+        if updates:
+            await self.db.status_rollups.bulk_write(updates, ordered=False)
+
+    async def compact(self) -> int:
+        """Delete raw checks that are summarized and past retention"""
+        if not self.retention:
+            return 0
+        state = await self.db.status_rollup_state.find_one({'_id': self.STATE_ID})
+        if state is None:
+            return 0
+        # Keep every check in a bucket the next pass may recount
+        widest = timedelta(seconds=max(self.buckets, default=0))
+        cutoff = min(state['watermark'] - widest, datetime.utcnow() - self.retention)
+        with self.track('mongodb', 'status_compact'):
+            result = await self.db.status_checks.delete_many({'timestamp': {'$lt': cutoff}})
+        return result.deleted_count
+
+    async def run(self) -> None:
+        while True:
+            try:
+                while await self.run_once():
+                    pass
+                deleted = await self.compact()
+                if deleted:
+                    logger.info(f"Deleted {deleted} summarized status checks")
+            except Exception as e:
+                logger.error(f"Error rolling up status checks: {e}")
+            await asyncio.sleep(self.period)
+
+
+STATUS_CHECK_PROJECTION = {'_id': 0, 'id': 1, 'client_name': 1, 'timestamp': 1}
+
+
+class MongoStorage(Storage):
+    """MongoDB storage; status rollups are kept by a background stage"""
+
+    name = 'mongodb'
+
+    def __init__(self, client, db_name: str, rollup_buckets: List[int], rollup_period: float,
+                 rollup_lag: float, rollup_max_span: float, status_retention: float,
+                 rollup_retention: float, track: Track = no_track):
+        self.client = client
+        self.db = client[db_name]
+        self.rollup_buckets = rollup_buckets
+        self.rollup_retention = rollup_retention
+        self.track = track
+        self.rollups = StatusRollupAggregator(self.db, rollup_buckets, rollup_period, rollup_lag,
+                                              rollup_max_span, status_retention, track)
+        self._rollup_stage: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Open the connection pool and ensure indexes; failures are logged, not raised"""
+        try:
+            with self.track('mongodb', 'ping'):
+                await self.client.admin.command('ping')
+        except Exception as e:
+            logger.warning(f"MongoDB is not reachable: {e}")
+        else:
+            try:
+                await self.ensure_indexes()
+            except Exception as e:
+                logger.warning(f"Failed to create MongoDB indexes: {e}")
+        if self.rollup_buckets or self.rollups.retention:
+            self._rollup_stage = asyncio.create_task(self.rollups.run())
+
+    async def close(self) -> None:
+        if self._rollup_stage is not None:
+            self._rollup_stage.cancel()
+            try:
+                await self._rollup_stage
+            except asyncio.CancelledError:
+                pass
+            self._rollup_stage = None
+        self.client.close()
+
+    async def ensure_indexes(self) -> None:
+        db = self.db
+        await db.status_checks.create_index([('timestamp', 1), ('id', 1)])
+        await db.status_checks.create_index([('client_name', 1), ('timestamp', 1), ('id', 1)])
+        await db.status_rollups.create_index([('interval', 1), ('client_name', 1), ('bucket', 1)], unique=True)
+        await db.status_rollups.create_index([('interval', 1), ('bucket', 1), ('client_name', 1)])
+        await ensure_ttl_index(db.status_rollups, 'bucket', self.rollup_retention)
+        await db.location_history.create_index([('target_id', 1), ('updated_at', 1)])
+        await db.locations.create_index([('id', 1)], unique=True)
+        await db.locations.create_index([('location', '2dsphere')])
+        # Give locations stored before the geo index existed their GeoJSON point
+        await db.locations.update_many(
+            {'location': {'$exists': False}},
+            [{'$set': {'location': {'type': 'Point', 'coordinates': ['$longitude', '$latitude']}}}],
+        )
+
+    async def get_location(self, target_id: str) -> Optional[dict]:
+        with self.track('mongodb', 'location_get'):
+            return await self.db.locations.find_one({'id': target_id}, {'_id': 0, 'location': 0})
+
+    async def put_location(self, location: dict, operation: str) -> dict:
+        """Upsert a location along with its indexed GeoJSON point"""
+        document = {**location, 'location': geo_point(location['latitude'], location['longitude'])}
+        with self.track('mongodb', operation):
+            await self.db.locations.replace_one({'id': location['id']}, document, upsert=True)
+        return dict(location)
+
+    async def nearby_locations(self, latitude: float, longitude: float, radius: Optional[float],
+                               limit: int) -> List[dict]:
+        """Answered by $geoNear on the 2dsphere index"""
+        geo_near = {
+            'near': geo_point(latitude, longitude),
+            'key': 'location',
+            'distanceField': 'distance',
+            'distanceMultiplier': 0.001,
+            'spherical': True,
+        }
+        if radius is not None:
+            geo_near['maxDistance'] = radius * 1000
+        pipeline = [{'$geoNear': geo_near}, {'$limit': limit}, {'$project': {'_id': 0, 'location': 0}}]
+        with self.track('mongodb', 'location_nearby'):
+            return await self.db.locations.aggregate(pipeline).to_list(limit)
+
+    async def add_history(self, points: List[dict]) -> None:
+        with self.track('mongodb', 'history_insert'):
+            if len(points) == 1:
+                await self.db.location_history.insert_one(dict(points[0]))
+            else:
+                await self.db.location_history.insert_many([dict(point) for point in points], ordered=False)
+
+    async def location_history(self, target_id: str, since: datetime, until: Optional[datetime],
+                               bucket: Optional[int], limit: int) -> List[dict]:
+        match = {'target_id': target_id, 'updated_at': {'$gte': since}}
+        if until is not None:
+            match['updated_at']['$lt'] = until
+
+        if bucket is None:
+            with self.track('mongodb', 'history_range'):
+                return await self.db.location_history.find(match, {'_id': 0, 'target_id': 0}) \
+                    .sort('updated_at', 1).limit(limit).to_list(limit)
+
+        epoch_ms = {'$subtract': ['$updated_at', EPOCH]}
+        pipeline = [
+            {'$match': match},
+            # Points can be stored out of order; $last must see the latest
+            {'$sort': {'updated_at': 1}},
+            {'$group': {
+                '_id': {'$subtract': [epoch_ms, {'$mod': [epoch_ms, bucket * 1000]}]},
+                'latitude': {'$avg': '$latitude'},
+                'longitude': {'$avg': '$longitude'},
+                'address': {'$last': '$address'},
+                'updated_at': {'$max': '$updated_at'},
+                'count': {'$sum': 1},
+            }},
+            {'$sort': {'_id': 1}},
+            {'$limit': limit},
+            {'$project': {'_id': 0}},
+        ]
+        with self.track('mongodb', 'history_buckets'):
+            return await self.db.location_history.aggregate(pipeline).to_list(limit)
+
+    async def insert_status_checks(self, status_checks: List[dict], operation: str) -> None:
+        with self.track('mongodb', operation):
+            if len(status_checks) == 1:
+                await self.db.status_checks.insert_one(dict(status_checks[0]))
+            else:
+                await self.db.status_checks.insert_many([dict(status_check) for status_check in status_checks],
+                                                        ordered=False)
+
+    @staticmethod
+    def _status_query(client_name: Optional[str], since: Optional[datetime],
+                      until: Optional[datetime], after: Optional[StatusKey]) -> dict:
+        """Build a filter served by the (client_name, timestamp, id) or (timestamp, id) index"""
+        clauses = []
+        if client_name is not None:
+            clauses.append({'client_name': client_name})
+        if since is not None:
+            clauses.append({'timestamp': {'$gte': since}})
+        if until is not None:
+            clauses.append({'timestamp': {'$lt': until}})
+        if after is not None:
+            timestamp, status_id = after
+            clauses.append({'$or': [
+                {'timestamp': {'$gt': timestamp}},
+                {'timestamp': timestamp, 'id': {'$gt': status_id}},
+            ]})
+        return {'$and': clauses} if clauses else {}
+
+    async def list_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                 until: Optional[datetime], after: Optional[StatusKey],
+                                 limit: int) -> List[dict]:
+        query = self._status_query(client_name, since, until, after)
+        with self.track('mongodb', 'status_list'):
+            return await self.db.status_checks.find(query, STATUS_CHECK_PROJECTION) \
+                .sort([('timestamp', 1), ('id', 1)]).limit(limit).to_list(limit)
+
+    async def stream_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                   until: Optional[datetime], after: Optional[StatusKey],
+                                   limit: Optional[int], batch_size: int) -> AsyncIterator[dict]:
+        query = self._status_query(client_name, since, until, after)
+        cursor = self.db.status_checks.find(query, STATUS_CHECK_PROJECTION) \
+            .sort([('timestamp', 1), ('id', 1)]).batch_size(batch_size)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        async for status_check in cursor:
+            yield status_check
+
+    async def status_rollups(self, interval: int, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], limit: int) -> List[dict]:
+        query: Dict[str, Any] = {'interval': interval}
+        if client_name is not None:
+            query['client_name'] = client_name
+        if since is not None or until is not None:
+            query['bucket'] = {}
+            if since is not None:
+                query['bucket']['$gte'] = since
+            if until is not None:
+                query['bucket']['$lt'] = until
+        with self.track('mongodb', 'status_rollups'):
+            return await self.db.status_rollups.find(query, {'_id': 0}) \
+                .sort([('bucket', 1), ('client_name', 1)]).limit(limit).to_list(limit)
+
+
+class SupabaseStorage(Storage):
+    """Current locations in Supabase, with MongoDB for everything else.
+
+    Supabase's client is synchronous, so calls run on a bounded thread pool
+    with a timeout and are recorded in a circuit breaker. While the breaker
+    is open locations are read from and written to the fallback instead; a
+    background probe closes it again once Supabase recovers. Every location
+    written to Supabase is also copied to the fallback so nearby queries
+    cover all targets. Reads compare the two copies, so positions written
+    to the fallback during an outage are served, and copied back to
+    Supabase, once it recovers.
+    """
+
+    name = 'supabase'
+
+    def __init__(self, url: str, key: str, fallback: Storage, breaker: CircuitBreaker, timeout: float,
+                 max_workers: int, probe_interval: float, track: Track = no_track):
+        self.url = url
+        self.key = key
+        self.fallback = fallback
+        self.breaker = breaker
+        self.timeout = timeout
+        self.probe_interval = probe_interval
+        self.track = track
+        self.max_workers = max_workers
+        # Created by start() so the storage can be started again after close()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._client: Optional[Client] = None
+        self._probe: Optional[asyncio.Task] = None
+
+    @property
+    def fallback_active(self) -> bool:
+        return not self.breaker.closed
+
+    def client(self) -> Client:
+        """Create the Supabase client on first use; nothing connects at import"""
+        if self._client is None:
+            self._client = create_client(self.url, self.key,
+                                         options=ClientOptions(postgrest_client_timeout=self.timeout))
+        return self._client
+
+    async def run(self, query, operation: str) -> Any:
+        """Execute a Supabase query builder on the executor without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            with self.track('supabase', operation):
+                result = await asyncio.wait_for(loop.run_in_executor(self.executor, query.execute),
+                                                timeout=self.timeout)
+        except Exception:
+            self.breaker.record(False, time.perf_counter() - start)
+            raise
+        self.breaker.record(True, time.perf_counter() - start)
+        return result
+
+    async def check_health(self) -> None:
+        """Probe Supabase once, recording the outcome in the breaker"""
+        try:
+            await self.run(self.client().table('locations').select('id').limit(1), 'health_probe')
+        except Exception as e:
+            logger.debug(f"Supabase health probe failed: {e!r}")
+
+    async def _probe_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await self.check_health()
+
+    async def start(self) -> None:
+        """Start the fallback while the first probe settles which backend is active"""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='supabase')
+        await asyncio.gather(self.fallback.start(), self.check_health())
+        self._probe = asyncio.create_task(self._probe_periodically())
+
+    async def close(self) -> None:
+        if self._probe is not None:
+            self._probe.cancel()
+            try:
+                await self._probe
+            except asyncio.CancelledError:
+                pass
+            self._probe = None
+        await self.fallback.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    @staticmethod
+    def _parse_row(row: dict) -> dict:
+        """Stored row with its string timestamp parsed to naive UTC"""
+        row = dict(row)
+        if isinstance(row.get('updated_at'), str):
+            updated_at = datetime.fromisoformat(row['updated_at'].replace('Z', '+00:00'))
+            if updated_at.tzinfo is not None:
+                updated_at = (updated_at - updated_at.utcoffset()).replace(tzinfo=None)
+            row['updated_at'] = updated_at
+        return row
+
+    async def _fallback_copy(self, target_id: str) -> Optional[dict]:
+        try:
+            return await self.fallback.get_location(target_id)
+        except Exception as e:
+            logger.error(f"Error reading location {target_id} from {self.fallback.name}: {e}")
+            return None
+
+    async def get_location(self, target_id: str) -> Optional[dict]:
+        if not self.breaker.closed:
+            return await self.fallback.get_location(target_id)
+        result, copy = await asyncio.gather(
+            self.run(self.client().table('locations').select('*').eq('id', target_id), 'location_get'),
+            self._fallback_copy(target_id))
+        row = self._parse_row(result.data[0]) if result.data else None
+        if copy is None or (row is not None and row['updated_at'] >= copy['updated_at']):
+            return row
+        # Written to the fallback while the breaker was open
+        try:
+            await self.run(self.client().table('locations').upsert(
+                {**copy, 'updated_at': copy['updated_at'].isoformat()}), 'location_repair')
+        except Exception as e:
+            logger.error(f"Error copying location {target_id} back to Supabase: {e}")
+        return copy
+
+    async def put_location(self, location: dict, operation: str) -> dict:
+        if not self.breaker.closed:
+            return await self.fallback.put_location(location, operation)
+        row = {**location, 'updated_at': location['updated_at'].isoformat()}
+        result = await self.run(self.client().table('locations').upsert(row), operation)
+        if not result.data:
+            raise RuntimeError("Supabase returned no row for the stored location")
+        stored = self._parse_row(result.data[0])
+        try:
+            await self.fallback.put_location(location, 'location_index')
+        except Exception as e:
+            logger.error(f"Error copying location {location['id']} to {self.fallback.name}: {e}")
+        return stored
+
+    async def nearby_locations(self, latitude: float, longitude: float, radius: Optional[float],
+                               limit: int) -> List[dict]:
+        return await self.fallback.nearby_locations(latitude, longitude, radius, limit)
+
+    async def add_history(self, points: List[dict]) -> None:
+        await self.fallback.add_history(points)
+
+    async def location_history(self, target_id: str, since: datetime, until: Optional[datetime],
+                               bucket: Optional[int], limit: int) -> List[dict]:
+        return await self.fallback.location_history(target_id, since, until, bucket, limit)
+
+    async def insert_status_checks(self, status_checks: List[dict], operation: str) -> None:
+        await self.fallback.insert_status_checks(status_checks, operation)
+
+    async def list_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                 until: Optional[datetime], after: Optional[StatusKey],
+                                 limit: int) -> List[dict]:
+        return await self.fallback.list_status_checks(client_name, since, until, after, limit)
+
+    def stream_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], after: Optional[StatusKey],
+                             limit: Optional[int], batch_size: int) -> AsyncIterator[dict]:
+        return self.fallback.stream_status_checks(client_name, since, until, after, limit, batch_size)
+
+    async def status_rollups(self, interval: int, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], limit: int) -> List[dict]:
+        return await self.fallback.status_rollups(interval, client_name, since, until, limit)
+
+
+class LocalStorage(Storage):
+    """Base for the single-node backends, which have no rollup stage.
+
+    Rollups are aggregated from the raw checks, so the raw checks are kept
+    until both STATUS_RETENTION and STATUS_ROLLUP_RETENTION have passed (and
+    for good if either is 0), deleted by a background stage every `period`
+    seconds.
+    """
+
+    def __init__(self, status_retention: float, rollup_retention: float, period: float):
+        retention = max(status_retention, rollup_retention) if min(status_retention, rollup_retention) > 0 else 0
+        self.retention = timedelta(seconds=retention)
+        self.period = period
+        if status_retention != rollup_retention:
+            kept = f"for {retention:g} seconds" if retention else "indefinitely"
+            logger.warning(f"{self.name} storage aggregates rollups from the raw status checks, "
+                           f"so raw checks and rollups are both kept {kept}")
+        self._retention_stage: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.retention:
+            self._retention_stage = asyncio.create_task(self._expire_periodically())
+
+    async def close(self) -> None:
+        if self._retention_stage is not None:
+            self._retention_stage.cancel()
+            try:
+                await self._retention_stage
+            except asyncio.CancelledError:
+                pass
+            self._retention_stage = None
+
+    async def delete_status_checks(self, before: datetime) -> int:
+        """Delete status checks older than `before`; returns how many"""
+        raise NotImplementedError
+
+    async def _expire_periodically(self) -> None:
+        while True:
+            try:
+                deleted = await self.delete_status_checks(datetime.utcnow() - self.retention)
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired status checks")
+            except Exception as e:
+                logger.error(f"Error deleting expired status checks: {e}")
+            await asyncio.sleep(self.period)
+
+
+def to_micros(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def ceil_bucket(micros: int, width: int) -> int:
+    """First `width`-microsecond bucket boundary at or after micros"""
+    return -(-micros // width) * width
+
+
+class SQLiteStorage(LocalStorage):
+    """Everything in one SQLite file.
+
+    Timestamps are stored as integer microseconds since the epoch. Queries
+    run on a single worker thread, which also serializes writes. Locations
+    are indexed by an R*Tree kept in step by triggers; nearby queries read
+    the targets in a bounding box and rank them by great-circle distance.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS locations (
+            id TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            address TEXT,
+            googlemapsurl TEXT,
+            updated_at INTEGER NOT NULL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS location_index USING rtree(
+            id, min_latitude, max_latitude, min_longitude, max_longitude
+        );
+        CREATE TRIGGER IF NOT EXISTS location_index_insert AFTER INSERT ON locations BEGIN
+            INSERT INTO location_index VALUES (new.rowid, new.latitude, new.latitude, new.longitude, new.longitude);
+        END;
+        CREATE TRIGGER IF NOT EXISTS location_index_update AFTER UPDATE OF latitude, longitude ON locations BEGIN
+            UPDATE location_index SET min_latitude = new.latitude, max_latitude = new.latitude,
+                min_longitude = new.longitude, max_longitude = new.longitude WHERE id = new.rowid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS location_index_delete AFTER DELETE ON locations BEGIN
+            DELETE FROM location_index WHERE id = old.rowid;
+        END;
+        -- Index locations stored before the index existed
+        INSERT INTO location_index
+            SELECT rowid, latitude, latitude, longitude, longitude FROM locations
+            WHERE rowid NOT IN (SELECT id FROM location_index);
+        CREATE TABLE IF NOT EXISTS location_history (
+            target_id TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            address TEXT,
+            updated_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS location_history_target_time ON location_history (target_id, updated_at);
+        CREATE TABLE IF NOT EXISTS status_checks (
+            id TEXT NOT NULL,
+            client_name TEXT NOT NULL,
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS status_checks_time ON status_checks (timestamp, id);
+        CREATE INDEX IF NOT EXISTS status_checks_client_time ON status_checks (client_name, timestamp, id);
+    """
+
+    # First radius in km tried for a nearby query without one; it grows 4x a try
+    NEARBY_START_RADIUS = 10.0
+
+    def __init__(self, path: str, status_retention: float = 0, rollup_retention: float = 0,
+                 retention_period: float = 30, track: Track = no_track):
+        super().__init__(status_retention, rollup_retention, retention_period)
+        self.path = path
+        self.track = track
+        # Created by start() so the storage can be started again after close()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> None:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(self.SCHEMA)
+        self._connection = connection
+
+    async def _call(self, operation: str, function: Callable, *args) -> Any:
+        with self.track('sqlite', operation):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _fetch(self, sql: str, params: Sequence = ()) -> List[dict]:
+        return [dict(row) for row in self._connection.execute(sql, params)]
+
+    def _write(self, sql: str, rows: Sequence[Sequence]) -> None:
+        with self._connection:
+            self._connection.executemany(sql, rows)
+
+    async def start(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        await self._call('connect', self._connect)
+        logger.info(f"Using SQLite storage at {self.path}")
+        await super().start()
+
+    async def close(self) -> None:
+        await super().close()
+        if self._connection is not None:
+            await self._call('close', self._connection.close)
+            self._connection = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    @staticmethod
+    def _location(row: dict) -> dict:
+        return {**row, 'updated_at': from_micros(row['updated_at'])}
+
+    async def get_location(self, target_id: str) -> Optional[dict]:
+        rows = await self._call('location_get', self._fetch, 'SELECT * FROM locations WHERE id = ?', (target_id,))
+        return self._location(rows[0]) if rows else None
+
+    async def put_location(self, location: dict, operation: str) -> dict:
+        row = (location['id'], location['latitude'], location['longitude'], location.get('address'),
+               location.get('googlemapsurl'), to_micros(location['updated_at']))
+        # An upsert keeps the rowid, which the R*Tree index refers to
+        await self._call(operation, self._write,
+                         'INSERT INTO locations VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET '
+                         'latitude = excluded.latitude, longitude = excluded.longitude, address = excluded.address, '
+                         'googlemapsurl = excluded.googlemapsurl, updated_at = excluded.updated_at', [row])
+        return dict(location)
+
+    def _fetch_within(self, latitude: float, longitude: float, radius: float) -> List[dict]:
+        """Locations in the bounding boxes of a circle, a superset of those in it"""
+        rows = []
+        for min_lat, max_lat, min_lon, max_lon in bounding_boxes(latitude, longitude, radius):
+            rows += self._fetch('SELECT locations.* FROM location_index JOIN locations ON locations.rowid = location_index.id '
+                                'WHERE min_latitude <= ? AND max_latitude >= ? AND min_longitude <= ? AND max_longitude >= ?',
+                                (max_lat, min_lat, max_lon, min_lon))
+        return rows
+
+    async def nearby_locations(self, latitude: float, longitude: float, radius: Optional[float],
+                               limit: int) -> List[dict]:
+        if radius is not None:
+            rows = await self._call('location_nearby', self._fetch_within, latitude, longitude, radius)
+            return nearest(map(self._location, rows), latitude, longitude, radius, limit)
+        # Widen the search until `limit` targets are within it; nothing
+        # outside a circle can be closer than the targets inside it
+        reach = self.NEARBY_START_RADIUS
+        while reach < math.pi * EARTH_RADIUS_KM:
+            rows = await self._call('location_nearby', self._fetch_within, latitude, longitude, reach)
+            found = nearest(map(self._location, rows), latitude, longitude, reach, limit)
+            if len(found) == limit:
+                return found
+            reach *= 4
+        rows = await self._call('location_nearby', self._fetch, 'SELECT * FROM locations')
+        return nearest(map(self._location, rows), latitude, longitude, None, limit)
+
+    async def add_history(self, points: List[dict]) -> None:
+        rows = [(point['target_id'], point['latitude'], point['longitude'], point.get('address'),
+                 to_micros(point['updated_at'])) for point in points]
+        await self._call('history_insert', self._write, 'INSERT INTO location_history VALUES (?, ?, ?, ?, ?)', rows)
+
+    async def location_history(self, target_id: str, since: datetime, until: Optional[datetime],
+                               bucket: Optional[int], limit: int) -> List[dict]:
+        where = 'target_id = ? AND updated_at >= ?'
+        params: List[Any] = [target_id, to_micros(since)]
+        if until is not None:
+            where += ' AND updated_at < ?'
+            params.append(to_micros(until))
+
+        if bucket is None:
+            rows = await self._call('history_range', self._fetch,
+                                    f'SELECT latitude, longitude, address, updated_at FROM location_history '
+                                    f'WHERE {where} ORDER BY updated_at LIMIT ?', (*params, limit))
+        else:
+            # With a single max() aggregate SQLite takes `address` from the latest row
+            rows = await self._call('history_buckets', self._fetch,
+                                    f'SELECT avg(latitude) AS latitude, avg(longitude) AS longitude, address, '
+                                    f'max(updated_at) AS updated_at, count(*) AS count FROM location_history '
+                                    f'WHERE {where} GROUP BY updated_at / ? ORDER BY updated_at / ? LIMIT ?',
+                                    (*params, bucket * 1_000_000, bucket * 1_000_000, limit))
+        return [{**row, 'updated_at': from_micros(row['updated_at'])} for row in rows]
+
+    async def insert_status_checks(self, status_checks: List[dict], operation: str) -> None:
+        rows = [(status_check['id'], status_check['client_name'], to_micros(status_check['timestamp']))
+                for status_check in status_checks]
+        await self._call(operation, self._write, 'INSERT INTO status_checks VALUES (?, ?, ?)', rows)
+
+    def _delete(self, sql: str, params: Sequence) -> int:
+        with self._connection:
+            return self._connection.execute(sql, params).rowcount
+
+    async def delete_status_checks(self, before: datetime) -> int:
+        return await self._call('status_expire', self._delete,
+                                'DELETE FROM status_checks WHERE timestamp < ?', (to_micros(before),))
+
+    async def list_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                 until: Optional[datetime], after: Optional[StatusKey],
+                                 limit: int) -> List[dict]:
+        clauses, params = [], []
+        if client_name is not None:
+            clauses.append('client_name = ?')
+            params.append(client_name)
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(to_micros(since))
+        if until is not None:
+            clauses.append('timestamp < ?')
+            params.append(to_micros(until))
+        if after is not None:
+            clauses.append('(timestamp, id) > (?, ?)')
+            params.extend((to_micros(after[0]), after[1]))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = await self._call('status_list', self._fetch,
+                                f'SELECT id, client_name, timestamp FROM status_checks {where} '
+                                f'ORDER BY timestamp, id LIMIT ?', (*params, limit))
+        return [{**row, 'timestamp': from_micros(row['timestamp'])} for row in rows]
+
+    async def status_rollups(self, interval: int, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], limit: int) -> List[dict]:
+        """Aggregated from the raw checks on each request"""
+        width = interval * 1_000_000
+        clauses, params = [], []
+        if client_name is not None:
+            clauses.append('client_name = ?')
+            params.append(client_name)
+        # Buckets starting in [since, until) hold the checks in these bounds
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(ceil_bucket(to_micros(since), width))
+        if until is not None:
+            clauses.append('timestamp < ?')
+            params.append(ceil_bucket(to_micros(until), width))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = await self._call('status_rollups', self._fetch,
+                                f'SELECT client_name, timestamp / ? * ? AS bucket, count(*) AS count, '
+                                f'min(timestamp) AS first_seen, max(timestamp) AS last_seen FROM status_checks '
+                                f'{where} GROUP BY client_name, bucket ORDER BY bucket, client_name LIMIT ?',
+                                (width, width, *params, limit))
+        return [{
+            'client_name': row['client_name'],
+            'interval': interval,
+            'bucket': from_micros(row['bucket']),
+            'count': row['count'],
+            'first_seen': from_micros(row['first_seen']),
+            'last_seen': from_micros(row['last_seen']),
+        } for row in rows]
+
+
+class MemoryStorage(LocalStorage):
+    """Process-local storage in sorted lists; nothing survives a restart.
+
+    Nearby queries rank every stored target.
+    """
+
+    name = 'memory'
+
+    def __init__(self, status_retention: float = 0, rollup_retention: float = 0, retention_period: float = 30):
+        super().__init__(status_retention, rollup_retention, retention_period)
+        self._locations: Dict[str, dict] = {}
+        self._history: Dict[str, List[dict]] = {}
+        self._history_times: Dict[str, List[datetime]] = {}
+        self._status_checks: List[dict] = []
+        self._status_keys: List[StatusKey] = []
+
+    async def get_location(self, target_id: str) -> Optional[dict]:
+        location = self._locations.get(target_id)
+        return dict(location) if location is not None else None
+
+    async def put_location(self, location: dict, operation: str) -> dict:
+        self._locations[location['id']] = dict(location)
+        return dict(location)
+
+    async def nearby_locations(self, latitude: float, longitude: float, radius: Optional[float],
+                               limit: int) -> List[dict]:
+        return nearest(self._locations.values(), latitude, longitude, radius, limit)
+
+    async def add_history(self, points: List[dict]) -> None:
+        for point in points:
+            history = self._history.setdefault(point['target_id'], [])
+            times = self._history_times.setdefault(point['target_id'], [])
+            index = bisect_right(times, point['updated_at'])
+            times.insert(index, point['updated_at'])
+            history.insert(index, {key: value for key, value in point.items() if key != 'target_id'})
+
+    async def location_history(self, target_id: str, since: datetime, until: Optional[datetime],
+                               bucket: Optional[int], limit: int) -> List[dict]:
+        times = self._history_times.get(target_id, [])
+        start = bisect_left(times, since)
+        end = bisect_left(times, until) if until is not None else len(times)
+        points = self._history.get(target_id, [])[start:end]
+        if bucket is None:
+            return [dict(point) for point in points[:limit]]
+
+        buckets: Dict[datetime, List[dict]] = {}
+        for point in points:
+            buckets.setdefault(bucket_start(point['updated_at'], bucket), []).append(point)
+        return [{
+            'latitude': sum(point['latitude'] for point in group) / len(group),
+            'longitude': sum(point['longitude'] for point in group) / len(group),
+            'address': group[-1]['address'],
+            'updated_at': group[-1]['updated_at'],
+            'count': len(group),
+        } for group in list(buckets.values())[:limit]]
+
+    async def insert_status_checks(self, status_checks: List[dict], operation: str) -> None:
+        for status_check in status_checks:
+            key = (status_check['timestamp'], status_check['id'])
+            if not self._status_keys or key >= self._status_keys[-1]:
+                self._status_keys.append(key)
+                self._status_checks.append(dict(status_check))
+            else:
+                index = bisect_right(self._status_keys, key)
+                self._status_keys.insert(index, key)
+                self._status_checks.insert(index, dict(status_check))
+
+    async def delete_status_checks(self, before: datetime) -> int:
+        end = bisect_left(self._status_keys, (before, ''))
+        del self._status_keys[:end]
+        del self._status_checks[:end]
+        return end
+
+    def _status_range(self, since: Optional[datetime], until: Optional[datetime],
+                      after: Optional[StatusKey]) -> Tuple[int, int]:
+        start = bisect_left(self._status_keys, (since, '')) if since is not None else 0
+        if after is not None:
+            start = max(start, bisect_right(self._status_keys, after))
+        end = bisect_left(self._status_keys, (until, '')) if until is not None else len(self._status_keys)
+        return start, end
+
+    async def list_status_checks(self, client_name: Optional[str], since: Optional[datetime],
+                                 until: Optional[datetime], after: Optional[StatusKey],
+                                 limit: int) -> List[dict]:
+        start, end = self._status_range(since, until, after)
+        if client_name is None:
+            return [dict(status_check) for status_check in self._status_checks[start:min(end, start + limit)]]
+        page = []
+        for status_check in self._status_checks[start:end]:
+            if status_check['client_name'] == client_name:
+                page.append(dict(status_check))
+                if len(page) == limit:
+                    break
+        return page
+
+    async def status_rollups(self, interval: int, client_name: Optional[str], since: Optional[datetime],
+                             until: Optional[datetime], limit: int) -> List[dict]:
+        """Aggregated from the raw checks on each request"""
+        width = interval * 1_000_000
+        since = from_micros(ceil_bucket(to_micros(since), width)) if since is not None else None
+        until = from_micros(ceil_bucket(to_micros(until), width)) if until is not None else None
+        start, end = self._status_range(since, until, None)
+        rollups: Dict[Tuple[datetime, str], dict] = {}
+        for status_check in self._status_checks[start:end]:
+            if client_name is not None and status_check['client_name'] != client_name:
+                continue
+            bucket = bucket_start(status_check['timestamp'], interval)
+            rollup = rollups.get((bucket, status_check['client_name']))
+            if rollup is None:
+                rollups[(bucket, status_check['client_name'])] = {
+                    'client_name': status_check['client_name'],
+                    'interval': interval,
+                    'bucket': bucket,
+                    'count': 1,
+                    'first_seen': status_check['timestamp'],
+                    'last_seen': status_check['timestamp'],
+                }
+            else:
+                rollup['count'] += 1
+                rollup['last_seen'] = status_check['timestamp']
+        return [rollups[key] for key in sorted(rollups)[:limit]]
@@ -6,12 +6,13 @@ Tests the Supabase integration and location endpoints
 
 import requests
 import json
+import os
 import sys
 from datetime import datetime
 from typing import Dict, Any
 
-# Backend URL from frontend environment
-BACKEND_URL = "https://swamiji-locator.preview.emergentagent.com/api"
+# Backend URL from frontend environment; set BACKEND_URL to test a local server
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://swamiji-locator.preview.emergentagent.com/api")
 
 class CompassAPITester:
     def __init__(self):
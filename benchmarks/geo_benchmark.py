@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the vectorized bearing/distance math in backend/geo.py
+Compares it with a per-point Python loop over the same formulas
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+from geo import bearings_and_distances, turn_angles  # noqa: E402
+
+TARGET = (12.308367, 76.645467)
+
+
+def python_loop(latitudes, longitudes, target_lat, target_lon):
+    """Reference implementation: one point at a time, like the app does"""
+    results = []
+    phi2 = math.radians(target_lat)
+    for lat, lon in zip(latitudes, longitudes):
+        phi1 = math.radians(lat)
+        delta_lambda = math.radians(target_lon - lon)
+        y = math.sin(delta_lambda) * math.cos(phi2)
+        x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(delta_lambda)
+        bearing = (math.degrees(math.atan2(y, x)) + 360) % 360
+        a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+        distance = 2 * 6371 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        results.append((bearing, distance))
+    return results
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(-60, 60, args.points)
+    longitudes = rng.uniform(-180, 180, args.points)
+    headings = rng.uniform(0, 360, args.points)
+
+    def vectorized():
+        bearings, _ = bearings_and_distances(latitudes, longitudes, *TARGET)
+        turn_angles(headings, bearings)
+
+    vectorized_s = best_of(args.repeat, vectorized)
+    loop_s = best_of(1, python_loop, latitudes.tolist(), longitudes.tolist(), *TARGET)
+
+    print(json.dumps({
+        'points': args.points,
+        'vectorized_ms': round(vectorized_s * 1000, 3),
+        'python_loop_ms': round(loop_s * 1000, 3),
+        'speedup': round(loop_s / vectorized_s, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
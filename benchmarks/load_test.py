@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Load test for the Compass backend
+Drives the location and status endpoints with concurrent async clients and
+reports throughput and latency percentiles as JSON
+
+By default the app is booted in-process on the storage backend chosen with
+--storage: memory (no external services, measures handler cost alone),
+sqlite (a temporary file) or mongodb (the MongoDB in MONGO_URL). Use --url
+to load an already running server instead.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+
+async def location_get(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.get('/api/location/swamiji')
+
+
+async def location_get_conditional(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    headers = {'If-None-Match': state['etag']} if state.get('etag') else {}
+    response = await client.get('/api/location/swamiji', headers=headers)
+    if 'etag' in response.headers:
+        state['etag'] = response.headers['etag']
+    return response
+
+
+async def location_update(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.post('/api/location/swamiji', json={
+        'latitude': 12.308367 + random.uniform(-0.01, 0.01),
+        'longitude': 76.645467 + random.uniform(-0.01, 0.01),
+        'address': 'Load test',
+    })
+
+
+async def status_create(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.post('/api/status', json={'client_name': f"load-test-{random.randrange(100)}"})
+
+
+async def status_list(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.get('/api/status', params={'limit': 100})
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, dict], Awaitable[httpx.Response]]] = {
+    'location_get': location_get,
+    'location_get_conditional': location_get_conditional,
+    'location_update': location_update,
+    'status_create': status_create,
+    'status_list': status_list,
+}
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, requests: int, concurrency: int) -> dict:
+    """Send `requests` requests from `concurrency` workers and summarize them"""
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        state: dict = {}
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, state)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(float(latencies_ms.max()), 3),
+        },
+    }
+
+
+def load_app(storage: str):
+    """Import server.py on the given storage backend"""
+    os.environ['STORAGE_BACKEND'] = storage
+    if storage == 'mongodb':
+        os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+        os.environ.setdefault('DB_NAME', 'compass_app_load_test')
+    elif storage == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='compass-load-test-'), 'compass.db')
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    return server.app
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> List[str]:
+    """List scenarios whose throughput or p95 regressed past max_regression"""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} rps")
+        if result['latency_ms']['p95'] > before['latency_ms']['p95'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms")
+    return regressions
+
+
+async def run(args) -> dict:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+        app = None
+    else:
+        app = load_app(args.storage)
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://load-test')
+
+    try:
+        # Make sure there is a location and some status checks to read
+        await client.post('/api/location/initialize')
+        for _ in range(args.warmup):
+            await client.post('/api/status', json={'client_name': 'warmup'})
+            await client.get('/api/location/swamiji')
+
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, args.requests, args.concurrency)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        'target': args.url or f"in-process ({args.storage})",
+        'scenarios': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="base URL of a running server, e.g. http://localhost:8000")
+    parser.add_argument('--storage', choices=['memory', 'sqlite', 'mongodb'], default='memory',
+                        help="storage backend for the in-process server")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report of a previous run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="allowed fractional drop in throughput or rise in p95 (default 0.2)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.max_regression)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# The backend runs from its own directory with flat imports (`import geo`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+# server.py reads its configuration at import; run it on in-memory storage
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
@@ -0,0 +1,84 @@
+import asyncio
+
+from mongomock.filtering import filter_applies
+from pymongo.errors import CollectionInvalid
+
+from bus import MongoChangeStreamBus
+
+
+class FakeChangeStream:
+    def __init__(self, match):
+        self.match = match
+        self.changes = asyncio.Queue()
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    async def insert_one(self, document):
+        self.database.notify({'operationType': 'insert', 'ns': {'coll': self.name}, 'fullDocument': dict(document)})
+
+
+class FakeDatabase:
+    """Delivers inserts to change streams whose $match accepts them"""
+
+    def __init__(self):
+        self.collections = set()
+        self.streams = []
+
+    async def create_collection(self, name, **options):
+        if name in self.collections:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self.collections.add(name)
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+    def watch(self, pipeline, **options):
+        stream = FakeChangeStream(pipeline[0]['$match'])
+        self.streams.append(stream)
+        return stream
+
+    def notify(self, change):
+        for stream in self.streams:
+            if filter_applies(stream.match, change):
+                stream.changes.put_nowait(change)
+
+
+def test_mongo_bus_carries_messages_and_location_writes_to_other_workers():
+    database = FakeDatabase()
+    received = {'a': [], 'b': []}
+
+    async def scenario():
+        workers = {name: MongoChangeStreamBus(database) for name in received}
+        for name, bus in workers.items():
+            await bus.start(received[name].append)
+        await asyncio.sleep(0)
+
+        workers['a'].publish({'type': 'invalidate', 'target_id': None})
+        await asyncio.sleep(0.01)
+        await database['locations'].insert_one({'_id': 1, 'id': 'swamiji', 'latitude': 10.0, 'longitude': 76.0,
+                                                'location': {'type': 'Point', 'coordinates': [76.0, 10.0]}})
+        await asyncio.sleep(0.01)
+        for bus in workers.values():
+            await bus.close()
+
+    asyncio.run(scenario())
+    location = {'type': 'location', 'location': {'id': 'swamiji', 'latitude': 10.0, 'longitude': 76.0}}
+    assert received['a'] == [location]
+    assert received['b'] == [{'type': 'invalidate', 'target_id': None}, location]
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from geo import bearings_and_distances, bounding_boxes, distance_m, simplify_path, smooth_fixes, turn_angles
+
+METRES_PER_DEGREE = 111195.0
+LATITUDE, LONGITUDE = 12.308367, 76.645467
+
+
+def noisy_fixes(rng, n, accuracy=5.0, latitude=LATITUDE, longitude=LONGITUDE):
+    times = np.arange(n, dtype=float)
+    latitudes = latitude + rng.normal(0, accuracy, n) / METRES_PER_DEGREE
+    longitudes = longitude + rng.normal(0, accuracy, n) / (METRES_PER_DEGREE * np.cos(np.radians(latitude)))
+    return times, latitudes, longitudes, np.full(n, accuracy)
+
+
+def test_bearings_and_distances_match_scalar_distance():
+    bearings, distances = bearings_and_distances([0.0, 0.0], [0.0, 1.0], 1.0, 0.0)
+    assert bearings[0] == pytest.approx(0.0)
+    assert bearings[1] == pytest.approx(315.0, abs=0.1)
+    assert distances[0] * 1000 == pytest.approx(distance_m(0, 0, 1, 0))
+
+
+@pytest.mark.parametrize('latitude, longitude, radius', [
+    (LATITUDE, LONGITUDE, 5.0),
+    (60.0, 179.9, 50.0),
+    (-45.0, -179.5, 200.0),
+    (89.9, 0.0, 30.0),
+    (0.0, 0.0, 30000.0),
+])
+def test_bounding_boxes_cover_the_circle(latitude, longitude, radius):
+    boxes = bounding_boxes(latitude, longitude, radius)
+    bearings = np.radians(np.arange(0, 360, 5.0))
+    for fraction in (0.5, 0.999):
+        # Points at that distance along each bearing
+        angle = fraction * radius / 6371.0
+        phi, lam = np.radians(latitude), np.radians(longitude)
+        lat2 = np.arcsin(np.sin(phi) * np.cos(angle) + np.cos(phi) * np.sin(angle) * np.cos(bearings))
+        lon2 = lam + np.arctan2(np.sin(bearings) * np.sin(angle) * np.cos(phi),
+                                np.cos(angle) - np.sin(phi) * np.sin(lat2))
+        for lat, lon in zip(np.degrees(lat2), (np.degrees(lon2) + 180) % 360 - 180):
+            assert any(box[0] <= lat <= box[1] and box[2] <= lon <= box[3] for box in boxes), (lat, lon)
+
+
+def test_bounding_boxes_split_at_the_antimeridian():
+    boxes = bounding_boxes(0.0, 179.95, 20.0)
+    assert len(boxes) == 2
+    assert boxes[0][3] == 180.0 and boxes[1][2] == -180.0
+
+
+def test_turn_angles_are_signed_and_wrap():
+    assert turn_angles(np.array([350.0, 10.0, 0.0]), np.array([10.0, 350.0, 180.0])).tolist() == [20.0, -20.0, 180.0]
+
+
+def test_simplify_path_keeps_endpoints_and_corners():
+    latitudes = [0.0, 0.0, 0.0, 0.001, 0.002]
+    longitudes = [0.0, 0.001, 0.002, 0.002, 0.002]
+    assert simplify_path(latitudes, longitudes, 5.0).tolist() == [0, 2, 4]
+
+
+@pytest.mark.parametrize('jump', [30, 100, 200, 1000, 66000])
+def test_smooth_fixes_rejects_a_single_jump(jump):
+    rng = np.random.default_rng(jump)
+    times, latitudes, longitudes, accuracies = noisy_fixes(rng, 10)
+    latitudes[4] += jump / METRES_PER_DEGREE
+
+    kept, smoothed_lat, smoothed_lon, _ = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0)
+
+    assert 4 not in kept.tolist()
+    assert len(kept) >= 8
+    assert distance_m(smoothed_lat[-1], smoothed_lon[-1], LATITUDE, LONGITUDE) < 10
+
+
+def test_smooth_fixes_rejects_several_outliers():
+    rng = np.random.default_rng(7)
+    times, latitudes, longitudes, accuracies = noisy_fixes(rng, 20)
+    latitudes[[3, 4]] += 500 / METRES_PER_DEGREE
+    longitudes[15] -= 2000 / METRES_PER_DEGREE
+
+    kept, smoothed_lat, smoothed_lon, _ = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0)
+
+    assert not {3, 4, 15} & set(kept.tolist())
+    assert distance_m(smoothed_lat[-1], smoothed_lon[-1], LATITUDE, LONGITUDE) < 10
+
+
+def test_smooth_fixes_rarely_rejects_good_fixes():
+    rng = np.random.default_rng(0)
+    rejected = 0
+    for _ in range(200):
+        times, latitudes, longitudes, accuracies = noisy_fixes(rng, 20)
+        kept, *_ = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0)
+        rejected += 20 - len(kept)
+    assert rejected / (200 * 20) < 0.02
+
+
+def test_smooth_fixes_never_rejects_a_majority():
+    rng = np.random.default_rng(1)
+    times, latitudes, longitudes, accuracies = noisy_fixes(rng, 9)
+    latitudes += rng.uniform(-0.05, 0.05, 9)
+
+    kept, *_ = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0)
+
+    assert len(kept) >= 5
+
+
+def test_smooth_fixes_reduces_jitter_and_sorts_by_time():
+    rng = np.random.default_rng(2)
+    times, latitudes, longitudes, accuracies = noisy_fixes(rng, 30, accuracy=8.0)
+    shuffled = rng.permutation(30)
+
+    kept, smoothed_lat, smoothed_lon, variances = smooth_fixes(
+        times[shuffled], latitudes[shuffled], longitudes[shuffled], accuracies, 2.0, 3.0)
+
+    assert np.all(np.diff(times[shuffled][kept]) >= 0)
+    assert distance_m(smoothed_lat[-1], smoothed_lon[-1], LATITUDE, LONGITUDE) < 8
+    assert np.sqrt(variances[-1]) < 8
+
+
+def test_smooth_fixes_uses_an_agreeing_prior_and_drops_a_contradicted_one():
+    rng = np.random.default_rng(3)
+    times, latitudes, longitudes, accuracies = noisy_fixes(rng, 5)
+    _, _, _, alone = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0)
+    _, _, _, with_prior = smooth_fixes(times, latitudes, longitudes, accuracies, 2.0, 3.0,
+                                       prior=(-1.0, LATITUDE, LONGITUDE, 25.0))
+    assert with_prior[-1] < alone[-1]
+
+    _, smoothed_lat, _, _ = smooth_fixes(times, latitudes + 1, longitudes, accuracies, 2.0, 3.0,
+                                         prior=(-1.0, LATITUDE, LONGITUDE, 25.0))
+    assert smoothed_lat[-1] == pytest.approx(LATITUDE + 1, abs=1e-4)
+
+
+def test_smooth_fixes_across_the_antimeridian():
+    _, _, smoothed_lon, _ = smooth_fixes([0, 1, 2], [0, 0, 0], [179.9999, -179.9999, 180.0], [5, 5, 5], 1.0, 3.0)
+    assert np.all(np.abs(smoothed_lon) > 179.999)
@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+import pytest
+
+from geo import distance_m
+from geofence import SWEEP_INTERVAL, GeofenceRegistry, GeofenceTransition
+
+LATITUDE, LONGITUDE = 12.308367, 76.645467
+
+
+@pytest.fixture
+def registry():
+    return GeofenceRegistry(cell_size=0.01, ttl=3600)
+
+
+def test_state_is_unknown_until_the_target_is_seen(registry):
+    assert registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100) is None
+    assert registry.get('phone').inside is None
+
+    # The first position sets the state without an alert
+    assert registry.update_target('swamiji', LATITUDE + 0.0005, LONGITUDE) == []
+    device = registry.get('phone')
+    assert device.inside is True
+    assert device.distance == pytest.approx(distance_m(LATITUDE, LONGITUDE, LATITUDE + 0.0005, LONGITUDE))
+
+
+def test_exit_and_enter_transitions(registry):
+    registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100)
+    registry.update_target('swamiji', LATITUDE, LONGITUDE)
+
+    [exit_] = registry.update_target('swamiji', LATITUDE + 0.002, LONGITUDE)
+    assert exit_ == GeofenceTransition('phone', 'swamiji', False, pytest.approx(222.4, abs=0.5), 100)
+    assert registry.update_target('swamiji', LATITUDE + 0.003, LONGITUDE) == []
+    [enter] = registry.update_target('swamiji', LATITUDE, LONGITUDE)
+    assert enter.entered and enter.distance == pytest.approx(0)
+
+
+def test_moving_a_device_keeps_its_state_and_reports_a_change(registry):
+    registry.update_target('swamiji', LATITUDE, LONGITUDE)
+    assert registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100) is None
+    transition = registry.register('phone', 'swamiji', LATITUDE + 0.01, LONGITUDE, 100)
+    assert transition is not None and not transition.entered
+    assert len(registry) == 1
+
+
+def test_other_targets_do_not_trigger_fences(registry):
+    registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100)
+    registry.update_target('swamiji', LATITUDE, LONGITUDE)
+    assert registry.update_target('other', LATITUDE + 1, LONGITUDE) == []
+    assert registry.get('phone').inside is True
+
+
+def test_unregister_and_expiry():
+    registry = GeofenceRegistry(cell_size=0.01, ttl=3600)
+    registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100)
+    assert registry.unregister('phone')
+    assert not registry.unregister('phone')
+    assert registry.get('phone') is None
+
+    expiring = GeofenceRegistry(cell_size=0.01, ttl=0)
+    expiring.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100)
+    assert expiring.get('phone') is None
+    assert expiring.sweep() == 0 and len(expiring) == 0
+
+
+@pytest.mark.parametrize('latitude, longitude', [(LATITUDE, LONGITUDE), (0.0, 179.99), (84.0, 0.0)])
+def test_incremental_updates_match_checking_every_device(latitude, longitude):
+    rng = np.random.default_rng(7)
+    registry = GeofenceRegistry(cell_size=0.01, ttl=3600)
+    devices = {}
+    for i in range(300):
+        device = (latitude + rng.normal(0, 0.02), (longitude + rng.normal(0, 0.05) + 180) % 360 - 180,
+                  float(rng.choice([20, 150, 900, 5000])))
+        devices[f'device-{i}'] = device
+        registry.register(f'device-{i}', 'swamiji', *device)
+
+    target = (latitude, longitude)
+    registry.update_target('swamiji', *target)
+    inside = {device_id: distance_m(*target, lat, lon) <= radius for device_id, (lat, lon, radius) in devices.items()}
+    for _ in range(50):
+        target = (target[0] + rng.normal(0, 0.003), (target[1] + rng.normal(0, 0.003) + 180) % 360 - 180)
+        transitions = registry.update_target('swamiji', *target)
+        now_inside = {device_id: distance_m(*target, lat, lon) <= radius
+                      for device_id, (lat, lon, radius) in devices.items()}
+        expected = {device_id for device_id in devices if now_inside[device_id] != inside[device_id]}
+        assert {transition.device_id for transition in transitions} == expected
+        assert all(transition.entered == now_inside[transition.device_id] for transition in transitions)
+        inside = now_inside
+
+
+def test_expired_devices_do_not_alert_and_are_not_counted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    registry = GeofenceRegistry(cell_size=0.01, ttl=10)
+    registry.register('phone', 'swamiji', LATITUDE, LONGITUDE, 100)
+    registry.register('tablet', 'other', LATITUDE, LONGITUDE, 100)
+    registry.update_target('swamiji', LATITUDE, LONGITUDE)
+
+    now[0] += 11
+    assert registry.update_target('swamiji', LATITUDE + 0.01, LONGITUDE) == []
+    assert len(registry) == 1
+
+    # Swept without any further registrations or target moves
+    now[0] += SWEEP_INTERVAL
+    assert len(registry) == 0
@@ -0,0 +1,47 @@
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_renders_labelled_series_sorted_and_escaped():
+    counter = Counter('requests_total', 'Requests', ['method', 'route'])
+    counter.inc('POST', '/b')
+    counter.inc('GET', '/a "quoted"', amount=2)
+    counter.inc('POST', '/b')
+
+    assert counter.render() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{method="GET",route="/a \\"quoted\\""} 2.0',
+        'requests_total{method="POST",route="/b"} 2.0',
+    ]
+
+
+def test_gauge_reads_its_value_at_render_time():
+    values = [1]
+    gauge = Gauge('devices', 'Devices', lambda: len(values))
+    values.append(2)
+
+    assert gauge.render()[-1] == 'devices 2.0'
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency', ['route'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/a')
+
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_registry_renders_metrics_in_registration_order():
+    registry = Registry()
+    registry.register(Gauge('b', 'B', lambda: 0))
+    registry.register(Counter('a', 'A'))
+
+    text = registry.render()
+    assert text.index('# HELP b') < text.index('# HELP a')
+    assert text.endswith('\n')
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client():
+    with TestClient(server.app) as client:
+        yield client
+
+
+
+def test_etag_matches_lists_weak_tags_and_wildcards():
+    assert server.etag_matches('"a", W/"b"', '"b"')
+    assert server.etag_matches(' * ', '"b"')
+    assert not server.etag_matches('"a"', '"b"')
+    assert not server.etag_matches(None, '"b"')
+
+
+def test_location_cache_entries_expire_and_invalidate(monkeypatch):
+    cache = server.LocationCache(ttl=10)
+    location = server.LocationData(id='cached', latitude=10.0, longitude=76.0, updated_at=datetime(2024, 1, 1))
+    entry = cache.set(location)
+    assert cache.get('cached') is entry
+    assert entry.body == server.encode_location(location)
+    # The ETag follows the content
+    assert cache.set(location).etag == entry.etag
+    assert cache.set(location.model_copy(update={'latitude': 11.0})).etag != entry.etag
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert cache.get('cached') is None
+    monkeypatch.undo()
+
+    cache.set(location)
+    cache.invalidate('cached')
+    assert cache.get('cached') is None
+    cache.set(location)
+    cache.invalidate()
+    assert cache.get('cached') is None
+
+
+def bus_location(target_id, latitude, updated_at):
+    return {'type': 'location', 'location': {
+        'id': target_id, 'latitude': latitude, 'longitude': 76.0, 'address': None,
+        'googlemapsurl': None, 'updated_at': updated_at.isoformat(),
+    }}
+
+
+def test_stale_bus_message_does_not_move_the_target_back(client):
+    client.post('/api/locations/bus-stale', json={'latitude': 10.0, 'longitude': 76.0})
+    current = client.get('/api/locations/bus-stale').json()
+
+    older = datetime.fromisoformat(current['updated_at']) - timedelta(seconds=5)
+    server.handle_bus_message(bus_location('bus-stale', 11.0, older))
+
+    assert client.get('/api/locations/bus-stale').json()['latitude'] == 10.0
+
+
+def test_newer_location_from_another_worker_supersedes_a_held_update(client):
+    client.post('/api/locations/bus-held', json={'latitude': 10.0, 'longitude': 76.0})
+    # Within LOCATION_WRITE_INTERVAL, so held for a trailing write
+    client.post('/api/locations/bus-held', json={'latitude': 10.5, 'longitude': 76.0})
+
+    server.handle_bus_message(bus_location('bus-held', 11.0, server.utcnow_ms() + timedelta(seconds=1)))
+    time.sleep(server.LOCATION_WRITE_INTERVAL + 0.2)
+
+    stored = client.portal.call(server.storage.get_location, 'bus-held')
+    assert stored['latitude'] == 10.0
+    assert client.get('/api/locations/bus-held').json()['latitude'] == 11.0
+
+
+@pytest.mark.parametrize('path', [
+    '/api/status',
+    '/api/status/rollups',
+    '/api/locations/tz-target/history',
+])
+def test_timezone_aware_ranges_are_accepted(client, path):
+    client.post('/api/locations/tz-target', json={'latitude': 10.0, 'longitude': 76.0})
+    client.post('/api/status', json={'client_name': 'tz'})
+
+    response = client.get(path, params={'since': '2020-01-01T00:00:00Z', 'until': '2100-01-01T05:30:00+05:30'})
+
+    assert response.status_code == 200
+    assert response.json()
+
+
+class RecordingBus:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, message):
+        self.messages.append(message)
+
+
+def test_geofence_registrations_are_shared_over_the_bus(client, monkeypatch):
+    bus = RecordingBus()
+    monkeypatch.setattr(server, 'location_bus', bus)
+    client.post('/api/locations/fence-target', json={'latitude': 10.0, 'longitude': 76.0})
+    registration = {'device_id': 'fence-device', 'target_id': 'fence-target',
+                    'latitude': 10.0005, 'longitude': 76.0, 'radius': 100}
+    assert client.post('/api/geofences', json=registration).json()['inside'] is True
+    client.delete('/api/geofences/fence-device')
+    registered, removed = [message for message in bus.messages if message['type'].startswith('geofence')]
+
+    # Replayed as a worker that has seen neither the target nor the device
+    server.geofences._targets.pop('fence-target')
+    server.handle_bus_message(registered)
+    assert client.get('/api/geofences/fence-device').json()['inside'] is True
+
+    server.handle_bus_message(removed)
+    assert client.get('/api/geofences/fence-device').status_code == 404
+
+
+def test_concurrent_cache_misses_share_one_storage_read(client, monkeypatch):
+    client.post('/api/locations/single-flight', json={'latitude': 10.0, 'longitude': 76.0})
+    server.location_cache.invalidate('single-flight')
+    reads = []
+    get_location = server.storage.get_location
+
+    async def slow_get_location(target_id):
+        reads.append(target_id)
+        await asyncio.sleep(0.05)
+        return await get_location(target_id)
+
+    monkeypatch.setattr(server.storage, 'get_location', slow_get_location)
+
+    async def read_concurrently():
+        return await asyncio.gather(*(server.get_current_location('single-flight') for _ in range(20)))
+
+    results = client.portal.call(read_concurrently)
+    assert reads == ['single-flight']
+    assert {result.location.latitude for result in results} == {10.0}
+    assert not server.location_fetches
+
+
+def test_mongodb_storage_does_not_connect_at_import(monkeypatch):
+    monkeypatch.setattr(server, 'STORAGE_BACKEND', 'mongodb')
+    monkeypatch.setenv('MONGO_URL', 'mongodb://127.0.0.1:1')
+    monkeypatch.setenv('DB_NAME', 'compass_test')
+
+    mongo = server.create_storage()
+
+    assert not mongo.client.delegate._topology._opened
+
+
+def test_slow_direct_write_does_not_hide_a_newer_held_update(client, monkeypatch):
+    put_location = server.storage.put_location
+
+    async def slow_put_location(location, operation):
+        await asyncio.sleep(0.3)
+        return await put_location(location, operation)
+
+    monkeypatch.setattr(server.storage, 'put_location', slow_put_location)
+
+    def update(latitude):
+        return {'id': 'race', 'latitude': latitude, 'longitude': 76.0, 'address': None,
+                'googlemapsurl': None, 'updated_at': server.utcnow_ms()}
+
+    async def race():
+        first = asyncio.create_task(server.location_writer.submit(update(10.0)))
+        await asyncio.sleep(0.05)
+        await server.location_writer.submit(update(11.0))
+        await first
+        served = (await server.get_current_location('race')).location.latitude
+        # The held update is written once the first write and the interval are over
+        await asyncio.sleep(server.LOCATION_WRITE_INTERVAL + 0.5)
+        return served, (await server.storage.get_location('race'))['latitude']
+
+    served, stored = client.portal.call(race)
+    assert served == 11.0
+    assert stored == 11.0
+    assert client.get('/api/locations/race').json()['latitude'] == 11.0
+
+
+def test_failed_fix_write_leaves_the_estimate_unchanged(client, monkeypatch):
+    async def failing_put_location(location, operation):
+        raise RuntimeError('storage down')
+
+    monkeypatch.setattr(server.storage, 'put_location', failing_put_location)
+    batch = {'fixes': [{'latitude': 10.0, 'longitude': 76.0, 'accuracy': 5.0,
+                        'timestamp': datetime.utcnow().isoformat() + 'Z'}]}
+
+    response = client.post('/api/locations/failed-fix/fixes', json=batch)
+
+    assert response.status_code == 500
+    assert 'failed-fix' not in server.fix_estimates
@@ -0,0 +1,419 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from storage import CircuitBreaker, MemoryStorage, MongoStorage, SQLiteStorage, SupabaseStorage, nearest
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / 'compass.db')
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'mongodb'])
+def backend(request, sqlite_path):
+    """Runs `scenario(storage)` against a started storage of each backend"""
+    def create():
+        if request.param == 'memory':
+            return MemoryStorage()
+        if request.param == 'sqlite':
+            return SQLiteStorage(sqlite_path)
+        return MongoStorage(AsyncMongoMockClient(), 'compass_test', rollup_buckets=[60, 3600], rollup_period=3600,
+                            rollup_lag=0, rollup_max_span=86400, status_retention=0, rollup_retention=0)
+
+    def run_scenario(scenario):
+        async def main():
+            storage = create()
+            await storage.start()
+            try:
+                return await scenario(storage)
+            finally:
+                await storage.close()
+        return run(main())
+
+    run_scenario.name = request.param
+    return run_scenario
+
+
+async def settle(storage):
+    """Let MongoDB's rollup stage catch up with the stored checks"""
+    if isinstance(storage, MongoStorage):
+        while await storage.rollups.run_once():
+            pass
+
+
+def random_locations(rng, n):
+    now = datetime(2024, 1, 1)
+    return [{
+        'id': f'target-{i}',
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'address': None,
+        'googlemapsurl': None,
+        'updated_at': now,
+    } for i, (latitude, longitude) in enumerate(zip(rng.uniform(-85, 85, n), rng.uniform(-180, 180, n)))]
+
+
+def test_sqlite_nearby_matches_a_full_scan(sqlite_path):
+    rng = np.random.default_rng(3)
+    locations = random_locations(rng, 300)
+
+    async def scenario():
+        storage = SQLiteStorage(sqlite_path)
+        await storage.start()
+        try:
+            for location in locations:
+                await storage.put_location(location, 'location_upsert')
+            # Moving a target must move its index entry
+            locations[0] = {**locations[0], 'latitude': 12.3, 'longitude': 76.6}
+            await storage.put_location(locations[0], 'location_upsert')
+            results = []
+            for latitude, longitude, radius, limit in [(12.3, 76.6, None, 5), (60.0, 179.9, 2000.0, 50),
+                                                        (-10.0, -40.0, None, 300), (0.0, 0.0, 1.0, 10)]:
+                results.append((await storage.nearby_locations(latitude, longitude, radius, limit),
+                                nearest(locations, latitude, longitude, radius, limit)))
+            return results
+        finally:
+            await storage.close()
+
+    for found, expected in run(scenario()):
+        assert [location['id'] for location in found] == [location['id'] for location in expected]
+
+
+
+def test_sqlite_storage_can_be_started_again_after_close(sqlite_path):
+    storage = SQLiteStorage(sqlite_path)
+    stored = location('walker', 10.0, 76.0)
+
+    async def first():
+        await storage.start()
+        await storage.put_location(stored, 'location_upsert')
+        await storage.close()
+
+    async def second():
+        await storage.start()
+        try:
+            return await storage.get_location('walker')
+        finally:
+            await storage.close()
+
+    run(first())
+    assert run(second()) == stored
+
+
+def test_sqlite_indexes_locations_stored_before_the_index(sqlite_path):
+    location = random_locations(np.random.default_rng(1), 1)[0]
+
+    async def scenario():
+        storage = SQLiteStorage(sqlite_path)
+        await storage.start()
+        await storage.put_location(location, 'location_upsert')
+        await storage._call('drop_index', storage._connection.executescript, 'DROP TABLE location_index')
+        await storage.close()
+
+        storage = SQLiteStorage(sqlite_path)
+        await storage.start()
+        try:
+            return await storage.nearby_locations(location['latitude'], location['longitude'], 1.0, 10)
+        finally:
+            await storage.close()
+
+    assert [found['id'] for found in run(scenario())] == [location['id']]
+
+
+@pytest.mark.parametrize('backend', [MemoryStorage, SQLiteStorage])
+def test_status_checks_expire_after_both_retentions(backend, sqlite_path):
+    now = datetime.utcnow()
+    status_checks = [{'id': str(i), 'client_name': 'probe', 'timestamp': now - timedelta(hours=hours)}
+                     for i, hours in enumerate([5, 3, 1])]
+    args = (sqlite_path,) if backend is SQLiteStorage else ()
+
+    async def scenario():
+        storage = backend(*args, status_retention=3600, rollup_retention=2 * 3600, retention_period=0.01)
+        await storage.start()
+        try:
+            await storage.insert_status_checks(status_checks, 'status_insert')
+            # A few passes of the retention stage
+            await asyncio.sleep(0.1)
+            return await storage.list_status_checks(None, None, None, None, 10)
+        finally:
+            await storage.close()
+
+    kept = run(scenario())
+    assert [status_check['id'] for status_check in kept] == ['2']
+
+
+def test_retention_is_off_when_either_is_unlimited():
+    assert not MemoryStorage(status_retention=3600, rollup_retention=0).retention
+    assert MemoryStorage(status_retention=60, rollup_retention=60).retention == timedelta(seconds=60)
+
+
+
+
+def test_circuit_breaker_starts_open_and_closes_on_a_fast_success():
+    breaker = CircuitBreaker('supabase', window=10, error_threshold=0.5, latency_threshold=1.0)
+    changes = []
+    breaker.on_change = changes.append
+
+    breaker.record(False, 0.1)
+    breaker.record(True, 2.0)
+    assert not breaker.closed
+    breaker.record(True, 0.1)
+    assert breaker.closed and changes == [True]
+
+
+def test_circuit_breaker_opens_on_errors_or_latency_after_min_calls():
+    breaker = CircuitBreaker('supabase', window=4, error_threshold=0.5, latency_threshold=1.0, min_calls=4)
+    breaker.record(True, 0.1)
+    for ok in (False, False, True):
+        breaker.record(ok, 0.1)
+    assert breaker.closed
+    breaker.record(False, 0.1)
+    assert not breaker.closed
+
+    breaker.record(True, 0.1)
+    for _ in range(4):
+        breaker.record(True, 1.5)
+    assert not breaker.closed
+
+
+
+class FakeSupabase:
+    """The slice of the Supabase client SupabaseStorage uses, over a dict of rows"""
+
+    def __init__(self):
+        self.rows = {}
+        self.down = False
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self.action = None
+
+    def select(self, columns):
+        self.action = ('select', None)
+        return self
+
+    def limit(self, count):
+        return self
+
+    def eq(self, column, value):
+        self.action = ('get', value)
+        return self
+
+    def upsert(self, row):
+        self.action = ('upsert', row)
+        return self
+
+    def execute(self):
+        if self.supabase.down:
+            raise ConnectionError("Supabase is down")
+        kind, value = self.action
+        if kind == 'upsert':
+            self.supabase.rows[value['id']] = dict(value)
+            return type('Result', (), {'data': [dict(value)]})
+        if kind == 'get':
+            return type('Result', (), {'data': [dict(self.supabase.rows[value])] if value in self.supabase.rows else []})
+        return type('Result', (), {'data': list(self.supabase.rows.values())[:1]})
+
+
+def test_supabase_serves_and_restores_locations_written_during_an_outage():
+    supabase = FakeSupabase()
+    storage = SupabaseStorage('http://supabase.invalid', 'key', fallback=MemoryStorage(),
+                              breaker=CircuitBreaker('supabase', window=2, error_threshold=0.5,
+                                                     latency_threshold=5, min_calls=2),
+                              timeout=5, max_workers=2, probe_interval=3600)
+    storage._client = supabase
+    start = datetime(2024, 1, 1)
+
+    async def scenario():
+        await storage.start()
+        try:
+            await storage.put_location(location_at(10.0, start), 'location_update')
+            supabase.down = True
+            await storage.check_health()
+            assert storage.fallback_active
+            await storage.put_location(location_at(11.0, start + timedelta(seconds=5)), 'location_update')
+            supabase.down = False
+            await storage.check_health()
+            assert not storage.fallback_active
+            return await storage.get_location('walker')
+        finally:
+            await storage.close()
+
+    assert run(scenario())['latitude'] == 11.0
+    # Copied back, so Supabase alone is current again
+    assert supabase.rows['walker']['latitude'] == 11.0
+
+    async def restart():
+        await storage.start()
+        try:
+            return storage.fallback_active, await storage.get_location('walker')
+        finally:
+            await storage.close()
+
+    fallback_active, restored = run(restart())
+    assert not fallback_active and restored['latitude'] == 11.0
+
+
+def location_at(latitude, updated_at):
+    return {'id': 'walker', 'latitude': latitude, 'longitude': 76.0, 'address': None,
+            'googlemapsurl': None, 'updated_at': updated_at}
+
+
+
+def test_mongodb_rollups_are_exact_when_passes_repeat():
+    storage = MongoStorage(AsyncMongoMockClient(), 'compass_test', rollup_buckets=[60, 3600], rollup_period=3600,
+                           rollup_lag=0, rollup_max_span=10 ** 9, status_retention=0, rollup_retention=0)
+    start = datetime(2024, 1, 1)
+    checks = [{'id': str(i), 'client_name': 'probe', 'timestamp': start + timedelta(seconds=7 * i)} for i in range(40)]
+
+    async def scenario():
+        await storage.insert_status_checks(checks, 'status_insert')
+        # A pass that died after writing one width, before advancing the watermark
+        await storage.rollups._watermark()
+        await storage.rollups._summarize(start, start + timedelta(seconds=90), 60)
+        while await storage.rollups.run_once():
+            pass
+        # Repeat every range, as workers racing on the watermark would
+        await storage.db.status_rollup_state.update_one({}, {'$set': {'watermark': start}})
+        while await storage.rollups.run_once():
+            pass
+        return (await storage.status_rollups(60, None, None, None, 100),
+                await storage.status_rollups(3600, None, None, None, 100))
+
+    minutes, hours = run(scenario())
+    assert [rollup['count'] for rollup in minutes] == [9, 9, 8, 9, 5]
+    assert [rollup['count'] for rollup in hours] == [40]
+
+
+# Storage contract, run against every backend
+
+START = datetime(2024, 1, 1)
+
+
+def location(target_id, latitude, longitude, seconds=0, address=None):
+    return {'id': target_id, 'latitude': latitude, 'longitude': longitude, 'address': address,
+            'googlemapsurl': None, 'updated_at': START + timedelta(seconds=seconds)}
+
+
+def test_contract_locations_are_stored_and_replaced(backend):
+    async def scenario(storage):
+        missing = await storage.get_location('walker')
+        await storage.put_location(location('walker', 10.0, 76.0), 'location_upsert')
+        first = await storage.get_location('walker')
+        await storage.put_location(location('walker', 11.0, 77.0, seconds=5, address='Mysuru'), 'location_upsert')
+        return missing, first, await storage.get_location('walker')
+
+    missing, first, second = backend(scenario)
+    assert missing is None
+    assert first == location('walker', 10.0, 76.0)
+    assert second == location('walker', 11.0, 77.0, seconds=5, address='Mysuru')
+
+
+def test_contract_nearby_locations_are_ranked_by_distance(backend):
+    if backend.name == 'mongodb':
+        pytest.skip("mongomock does not implement $geoNear")
+    locations = [location('near', 12.31, 76.65), location('mid', 12.5, 76.65), location('far', 13.5, 76.65),
+                 location('antipode', -12.3, -103.35)]
+
+    async def scenario(storage):
+        for target in locations:
+            await storage.put_location(target, 'location_upsert')
+        return (await storage.nearby_locations(12.3, 76.65, None, 3),
+                await storage.nearby_locations(12.3, 76.65, 50.0, 10))
+
+    closest, within = backend(scenario)
+    assert [target['id'] for target in closest] == ['near', 'mid', 'far']
+    assert closest[0]['distance'] == pytest.approx(1.112, abs=0.01)
+    assert [target['id'] for target in within] == ['near', 'mid']
+
+
+def test_contract_history_range_and_buckets(backend):
+    # Stored out of time order, two per minute
+    offsets = [90, 0, 30, 150, 60, 120]
+    points = [{'target_id': 'walker', 'latitude': 10.0 + seconds / 1000, 'longitude': 76.0,
+               'address': f'at {seconds}', 'updated_at': START + timedelta(seconds=seconds)} for seconds in offsets]
+    points.append({**points[0], 'target_id': 'other'})
+
+    async def scenario(storage):
+        await storage.add_history(points)
+        return (await storage.location_history('walker', START + timedelta(seconds=30), START + timedelta(seconds=150),
+                                               None, 10),
+                await storage.location_history('walker', START, None, None, 2),
+                await storage.location_history('walker', START, None, 60, 10))
+
+    ranged, limited, buckets = backend(scenario)
+    assert [point['updated_at'] for point in ranged] == [START + timedelta(seconds=s) for s in (30, 60, 90, 120)]
+    assert ranged[0] == {'latitude': 10.03, 'longitude': 76.0, 'address': 'at 30',
+                         'updated_at': START + timedelta(seconds=30)}
+    assert [point['address'] for point in limited] == ['at 0', 'at 30']
+    assert [(bucket['count'], bucket['address'], bucket['updated_at']) for bucket in buckets] == [
+        (2, 'at 30', START + timedelta(seconds=30)),
+        (2, 'at 90', START + timedelta(seconds=90)),
+        (2, 'at 150', START + timedelta(seconds=150)),
+    ]
+    assert buckets[0]['latitude'] == pytest.approx(10.015)
+
+
+def status_checks():
+    """Checks every 20 seconds for four minutes, alternating clients, with a tie on timestamp"""
+    checks = [{'id': f'{i:02d}', 'client_name': 'probe' if i % 2 else 'app',
+               'timestamp': START + timedelta(seconds=20 * i)} for i in range(12)]
+    checks.append({'id': '99', 'client_name': 'probe', 'timestamp': START + timedelta(seconds=40)})
+    return checks
+
+
+def test_contract_status_checks_are_paged_in_key_order(backend):
+    checks = status_checks()
+
+    async def scenario(storage):
+        # Inserted newest first
+        await storage.insert_status_checks(checks[::-1], 'status_insert')
+        return (await storage.list_status_checks(None, None, None, None, 100),
+                await storage.list_status_checks('probe', START + timedelta(seconds=40), START + timedelta(seconds=180),
+                                                 (START + timedelta(seconds=40), '02'), 3),
+                [check async for check in storage.stream_status_checks('app', None, None, None, 5, batch_size=2)])
+
+    everything, page, streamed = backend(scenario)
+    expected = sorted(checks, key=lambda check: (check['timestamp'], check['id']))
+    assert everything == expected
+    assert [check['id'] for check in page] == ['99', '03', '05']
+    assert [check['id'] for check in streamed] == ['00', '02', '04', '06', '08']
+
+
+def test_contract_status_rollups_count_each_bucket(backend):
+    checks = status_checks()
+
+    async def scenario(storage):
+        await storage.insert_status_checks(checks, 'status_insert')
+        await settle(storage)
+        return (await storage.status_rollups(60, None, None, None, 100),
+                await storage.status_rollups(60, 'probe', START + timedelta(seconds=30), START + timedelta(seconds=180), 100),
+                await storage.status_rollups(3600, None, None, None, 1))
+
+    minutes, probe, hours = backend(scenario)
+    expected = {}
+    for check in checks:
+        bucket = START + timedelta(minutes=(check['timestamp'] - START) // timedelta(minutes=1))
+        expected.setdefault((bucket, check['client_name']), []).append(check['timestamp'])
+    assert [{key: rollup[key] for key in ('bucket', 'client_name', 'count', 'first_seen', 'last_seen', 'interval')}
+            for rollup in minutes] == [
+        {'bucket': bucket, 'client_name': client_name, 'count': len(times),
+         'first_seen': min(times), 'last_seen': max(times), 'interval': 60}
+        for (bucket, client_name), times in sorted(expected.items())]
+    # Only buckets starting within [since, until)
+    assert [(rollup['bucket'], rollup['count']) for rollup in probe] == [
+        (START + timedelta(minutes=1), 2), (START + timedelta(minutes=2), 1)]
+    assert [(rollup['client_name'], rollup['count']) for rollup in hours] == [('app', 6)]